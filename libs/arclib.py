@@ -0,0 +1,165 @@
+"""Arc fitting (G2/G3) for dense toolpaths
+
+Replaces runs of G1 moves that lie on a circular arc in the XY plane with a
+single G2/G3 move. Works without Rhino on plain coordinate arrays.
+"""
+
+__author__ = "jose hernandez vargas"
+__version__ = "2024-09-02"
+
+import math
+import numpy as np
+from spatiallib import as_points
+
+# arcs are grown up to this many points, longer arcs are split
+MAX_ARC_POINTS = 512
+
+
+def _circle(p0, p1, p2):
+    """centre and radius of the circle through three XY points, None if collinear"""
+    ax, ay = p1[0] - p0[0], p1[1] - p0[1]
+    bx, by = p2[0] - p0[0], p2[1] - p0[1]
+    d = 2 * (ax * by - ay * bx)
+    if abs(d) < 1e-12:
+        return None
+    a2 = ax * ax + ay * ay
+    b2 = bx * bx + by * by
+    cx = p0[0] + (by * a2 - ay * b2) / d
+    cy = p0[1] + (ax * b2 - bx * a2) / d
+    return cx, cy, math.hypot(p0[0] - cx, p0[1] - cy)
+
+
+def _arc(pts, e, f, i, j, tolerance, etolerance, max_radius):
+    """
+    Checks if the points i to j (inclusive) are an arc within tolerance
+    Returns (direction, cx, cy) with direction 2 (clockwise) or 3, or None
+    """
+    p = pts[i:j + 1]
+    circle = _circle(p[0], p[(j - i) // 2], p[-1])
+    if circle is None:
+        return None
+    cx, cy, r = circle
+    if r > max_radius:
+        return None
+    dx = p[:, 0] - cx
+    dy = p[:, 1] - cy
+    # every point on the circle
+    if np.abs(np.hypot(dx, dy) - r).max() > tolerance:
+        return None
+    # every chord close to the arc (sagitta)
+    chords = np.hypot(np.diff(p[:, 0]), np.diff(p[:, 1]))
+    if chords.max() >= 2 * r:
+        return None
+    if (r - np.sqrt(r * r - (chords / 2) ** 2)).max() > tolerance:
+        return None
+    # a single turning direction, less than a full turn
+    angles = np.unwrap(np.arctan2(dy, dx))
+    steps = np.diff(angles)
+    if not (np.all(steps > 0) or np.all(steps < 0)):
+        return None
+    if abs(angles[-1] - angles[0]) >= 2 * math.pi - 1e-3:
+        return None
+    # Z, E and F must change linearly along the arc, as the firmware interpolates them
+    s = np.concatenate(([0.0], np.cumsum(chords)))
+    t = s / s[-1]
+    if np.abs(p[:, 2] - (p[0, 2] + (p[-1, 2] - p[0, 2]) * t)).max() > tolerance:
+        return None
+    if e is not None:
+        ee = e[i:j + 1]
+        if np.abs(ee - (ee[0] + (ee[-1] - ee[0]) * t)).max() > etolerance:
+            return None
+    if f is not None and np.any(f[i + 1:j + 1] != f[i + 1]):
+        return None
+    return (2 if steps[0] < 0 else 3), cx, cy
+
+
+def fit_arcs(pts, e=None, f=None, tolerance=0.02, etolerance=None,
+             min_points=4, max_radius=1000.0):
+    """
+    Splits a toolpath into linear and circular moves
+
+    Arguments
+        pts: N x 3 points
+        e: N absolute extrusion values (optional)
+        f: N feedrates (optional), arcs only span points with the same feedrate
+        tolerance: max distance in mm between the arc and the points / segments
+        etolerance: max deviation of the extrusion from an even distribution
+            along the arc, defaults to 1% of the mean extrusion per point
+        min_points: smallest number of points replaced by an arc
+        max_radius: larger radii are written as lines
+    Returns
+        list of moves (g, index, cx, cy): a G1 / G2 / G3 move to the point at index,
+        cx, cy is the arc centre (None for G1). The first point is not included
+    """
+    pts = as_points(pts)
+    n = len(pts)
+    if e is not None:
+        e = np.asarray(e, dtype=float)
+        if etolerance is None:
+            etolerance = 0.01 * abs(e[-1] - e[0]) / max(n - 1, 1) if n else 0
+    if f is not None:
+        f = np.broadcast_to(np.asarray(f, dtype=float), (n,))
+
+    def fits(i, j):
+        return j < n and _arc(pts, e, f, i, j, tolerance, etolerance, max_radius)
+
+    moves = []
+    i = 0
+    while i < n - 1:
+        if not fits(i, i + min_points - 1):
+            moves.append((1, i + 1, None, None))
+            i += 1
+            continue
+        # grow the arc by doubling, then bisect the last valid end
+        size = min_points - 1
+        while size * 2 <= MAX_ARC_POINTS and fits(i, i + size * 2):
+            size *= 2
+        lo, hi = i + size, min(i + size * 2, n - 1, i + MAX_ARC_POINTS)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if fits(i, mid):
+                lo = mid
+            else:
+                hi = mid - 1
+        g, cx, cy = fits(i, lo)
+        moves.append((g, lo, cx, cy))
+        i = lo
+    return moves
+
+
+def gcodearcs(pts, e=None, f=None, tolerance=0.02, decimals=3, **kwargs):
+    """
+    Creates a block of gcode from a toolpath with arcs fitted as G2 / G3 moves
+    The first point is not written, it is the current position of the nozzle
+
+    Arguments
+        pts: N x 3 points
+        e: N absolute extrusion values (optional)
+        f: feedrate, single value or one per point (optional)
+        tolerance: chord tolerance in mm
+        decimals: decimals for X, Y, Z, I, J and E
+        kwargs: other options for fit_arcs
+    Returns
+        str with one line per move
+    """
+    pts = as_points(pts)
+    if f is not None:
+        f = np.broadcast_to(np.asarray(f, dtype=float), (len(pts),))
+    fmt = "%." + str(int(decimals)) + "f"
+    lines = []
+    last = 0
+    lastf = None
+    for g, j, cx, cy in fit_arcs(pts, e, f, tolerance, **kwargs):
+        x, y, z = pts[j]
+        line = "G{} X{} Y{} Z{}".format(g, fmt % x, fmt % y, fmt % z)
+        if g != 1:
+            # centre relative to the start point of the arc
+            line += " I{} J{}".format(fmt % (cx - pts[last][0]), fmt % (cy - pts[last][1]))
+        if e is not None:
+            line += " E" + fmt % e[j]
+        if f is not None and f[j] and f[j] != lastf:
+            line += " F{}".format(int(f[j]))
+            lastf = f[j]
+        lines.append(line)
+        last = j
+    return "\n".join(lines)
@@ -0,0 +1,164 @@
+"""Geometry backends
+
+The toolpath code talks to a backend for points, distances, bounding boxes,
+polylines and curve division. Inside Rhino the default is RhinoBackend, which
+wraps rhinoscriptsyntax. Outside Rhino (batch workers, benchmarks) it is
+NumpyBackend, where curves are polylines given as N x 3 coordinate arrays.
+
+    import backendlib as bl
+    bl.set_backend("numpy")
+    bk = bl.get_backend()
+    pts = bk.divide_curve_length(polyline, 1.0)
+"""
+
+__author__ = "jose hernandez vargas"
+__version__ = "2024-09-02"
+
+import math
+import numpy as np
+
+try:
+    import rhinoscriptsyntax as rs
+except ImportError:  # running outside Rhino
+    rs = None
+
+
+class GeometryBackend:
+    """Interface of the geometry backends"""
+
+    name = None
+
+    def point(self, x, y, z):
+        """Creates a point (not a document object)"""
+        raise NotImplementedError
+
+    def coordinates(self, pts):
+        """Returns the coordinates of a list of points as an N x 3 array"""
+        return np.array([(pt[0], pt[1], pt[2]) for pt in pts], dtype=float).reshape(-1, 3)
+
+    def distance(self, a, b):
+        """Distance between two points"""
+        return math.sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2)
+
+    def bounding_box(self, geometry):
+        """Returns the 8 corners of the bounding box, in the order of rs.BoundingBox"""
+        raise NotImplementedError
+
+    def polyline(self, pts):
+        """Creates a polyline through a list of points"""
+        raise NotImplementedError
+
+    def polyline_points(self, polyline):
+        """Returns the vertices of a polyline"""
+        raise NotImplementedError
+
+    def curve_length(self, curve):
+        """Length of a curve"""
+        raise NotImplementedError
+
+    def divide_curve(self, curve, segments):
+        """Divides a curve in a number of segments of equal length, returns the points"""
+        raise NotImplementedError
+
+    def divide_curve_length(self, curve, length):
+        """Divides a curve in segments of a given length, returns the points"""
+        raise NotImplementedError
+
+
+class RhinoBackend(GeometryBackend):
+    """Backend using rhinoscriptsyntax, curves are Rhino objects"""
+
+    name = "rhino"
+
+    def __init__(self):
+        if rs is None:
+            raise ImportError("rhinoscriptsyntax is only available inside Rhino")
+
+    def point(self, x, y, z):
+        return rs.CreatePoint(x, y, z)
+
+    def distance(self, a, b):
+        return rs.Distance(a, b)
+
+    def bounding_box(self, geometry):
+        return rs.BoundingBox(geometry)
+
+    def polyline(self, pts):
+        return rs.AddPolyline(pts)
+
+    def polyline_points(self, polyline):
+        return rs.CurvePoints(polyline)
+
+    def curve_length(self, curve):
+        return rs.CurveLength(curve)
+
+    def divide_curve(self, curve, segments):
+        return rs.DivideCurve(curve, segments)
+
+    def divide_curve_length(self, curve, length):
+        return rs.DivideCurveLength(curve, length)
+
+
+class NumpyBackend(GeometryBackend):
+    """Backend on coordinate arrays, points are tuples and curves are polylines (N x 3 arrays)"""
+
+    name = "numpy"
+
+    def point(self, x, y, z):
+        return (float(x), float(y), float(z))
+
+    def coordinates(self, pts):
+        if isinstance(pts, np.ndarray):
+            return pts.reshape(-1, 3).astype(float, copy=False)
+        return super().coordinates(pts)
+
+    def bounding_box(self, geometry):
+        pts = self.coordinates(geometry)
+        if not len(pts):
+            return None
+        (x0, y0, z0), (x1, y1, z1) = pts.min(axis=0).tolist(), pts.max(axis=0).tolist()
+        return [(x0, y0, z0), (x1, y0, z0), (x1, y1, z0), (x0, y1, z0),
+                (x0, y0, z1), (x1, y0, z1), (x1, y1, z1), (x0, y1, z1)]
+
+    def polyline(self, pts):
+        return self.coordinates(pts).copy()
+
+    def polyline_points(self, polyline):
+        return [tuple(pt) for pt in self.coordinates(polyline).tolist()]
+
+    def curve_length(self, curve):
+        return float(np.linalg.norm(np.diff(self.coordinates(curve), axis=0), axis=1).sum())
+
+    def _at_lengths(self, curve, stations):
+        """points of a polyline at the given distances from its start"""
+        pts = self.coordinates(curve)
+        cumulative = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(pts, axis=0), axis=1))))
+        result = np.column_stack([np.interp(stations, cumulative, pts[:, k]) for k in range(3)])
+        return [tuple(pt) for pt in result.tolist()]
+
+    def divide_curve(self, curve, segments):
+        return self._at_lengths(curve, np.linspace(0, self.curve_length(curve), int(segments) + 1))
+
+    def divide_curve_length(self, curve, length):
+        total = self.curve_length(curve)
+        return self._at_lengths(curve, np.arange(0, total + length * 1e-9, length))
+
+
+BACKENDS = {"rhino": RhinoBackend, "numpy": NumpyBackend}
+_backend = None
+
+
+def set_backend(name):
+    """Selects the geometry backend by name ("rhino" or "numpy")"""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'. Use one of {list(BACKENDS)}")
+    _backend = BACKENDS[name]()
+    return _backend
+
+
+def get_backend():
+    """Returns the current backend, Rhino when available and numpy otherwise"""
+    if _backend is None:
+        set_backend("rhino" if rs is not None else "numpy")
+    return _backend
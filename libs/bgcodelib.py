@@ -0,0 +1,217 @@
+"""Compact binary encoding for Gcode
+
+File layout:
+    MAGIC, then a sequence of blocks
+    block: raw size (u32), compressed size (u32), crc32 of the block text (u32),
+        zlib-compressed payload
+Payload records:
+    0 <len> <bytes>            line written as text
+    1 <g> <count> (<word> <delta>)*
+                               move "G<g> X.. Y.." where every word is a letter and
+                               a number, stored as the difference to the previous
+                               value of the same letter in the block (zigzag varint)
+    2 <len> <bytes>            text without a final line break (end of the stream)
+The delta state starts again on each block, so every block can be decoded and
+checked on its own. Decoding rebuilds the exact original text.
+"""
+
+__author__ = "jose hernandez vargas"
+__version__ = "2024-09-02"
+
+import struct
+import zlib
+
+MAGIC = b"BGC1"
+LETTERS = "XYZEFIJR"
+BLOCK_HEADER = struct.Struct("<III")
+
+
+def _varint(value, out):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _number(text):
+    """(scaled integer, decimals) if text is a canonical decimal number, else None"""
+    whole, dot, fraction = text.partition(".")
+    decimals = len(fraction)
+    if decimals > 15 or (dot and not decimals):
+        return None
+    try:
+        value = int(whole + fraction)
+    except ValueError:
+        return None
+    # only numbers written back identically, e.g. not "-0.0" or "+1"
+    if _render(value, decimals) != text:
+        return None
+    return value, decimals
+
+
+def _render(value, decimals):
+    """writes a scaled integer as a decimal number"""
+    digits = str(abs(value)).rjust(decimals + 1, "0")
+    sign = "-" if value < 0 else ""
+    if decimals:
+        return sign + digits[:-decimals] + "." + digits[-decimals:]
+    return sign + digits
+
+
+def _encode_move(line, last, out):
+    """appends a move record to out, returns False if the line is not a plain move"""
+    words = line.split(" ")
+    g = words[0]
+    if len(g) < 2 or g[0] != "G" or not g[1:].isdigit() or int(g[1:]) > 255 \
+            or str(int(g[1:])) != g[1:] or len(words) > 16:
+        return False
+    record = bytearray((1, int(g[1:]), len(words) - 1))
+    for word in words[1:]:
+        letter = LETTERS.find(word[:1])
+        number = _number(word[1:]) if letter >= 0 and word else None
+        if number is None:
+            return False
+        value, decimals = number
+        delta = value - last[letter]
+        last[letter] = value
+        record.append(letter << 4 | decimals)
+        _varint(delta * 2 if delta >= 0 else -delta * 2 - 1, record)  # zigzag
+    out += record
+    return True
+
+
+def encode_block(text):
+    """
+    Encodes a piece of Gcode text (str) into a binary block (bytes)
+    """
+    out = bytearray()
+    last = [0] * len(LETTERS)
+    lines = text.split("\n")
+    tail = lines.pop()  # text after the last line break
+    for line in lines:
+        saved = list(last)
+        if not _encode_move(line, last, out):
+            last[:] = saved
+            data = line.encode("utf-8")
+            out.append(0)
+            _varint(len(data), out)
+            out += data
+    if tail:
+        data = tail.encode("utf-8")
+        out.append(2)
+        _varint(len(data), out)
+        out += data
+    payload = zlib.compress(bytes(out), 6)
+    crc = zlib.crc32(text.encode("utf-8"))
+    return BLOCK_HEADER.pack(len(out), len(payload), crc) + payload
+
+
+def decode_block(payload):
+    """
+    Decodes the payload of a binary block to Gcode text (str)
+    """
+    lines = []
+    last = [0] * len(LETTERS)
+    pos = 0
+    while pos < len(payload):
+        kind = payload[pos]
+        pos += 1
+        if kind == 1:
+            g, count = payload[pos], payload[pos + 1]
+            pos += 2
+            words = ["G{}".format(g)]
+            for _ in range(count):
+                code = payload[pos]
+                letter, decimals = code >> 4, code & 0x0F
+                zigzag, pos = _read_varint(payload, pos + 1)
+                last[letter] += (zigzag >> 1) ^ -(zigzag & 1)
+                words.append(LETTERS[letter] + _render(last[letter], decimals))
+            lines.append(" ".join(words) + "\n")
+        elif kind in (0, 2):
+            size, pos = _read_varint(payload, pos)
+            text = bytes(payload[pos:pos + size]).decode("utf-8")
+            pos += size
+            lines.append(text + "\n" if kind == 0 else text)
+        else:
+            raise ValueError(f"Unknown record type {kind} in binary Gcode")
+    return "".join(lines)
+
+
+class BinaryGCodeWriter:
+    """
+    File-like object that encodes the Gcode text written to it into binary blocks.
+    Each write() of complete lines becomes one block, a partial last line is kept
+    until the next write or close().
+    """
+
+    def __init__(self, file, magic=True):
+        self.file = file
+        self.pending = b""
+        if magic:
+            self.file.write(MAGIC)
+
+    def write(self, data):
+        data = self.pending + data
+        end = data.rfind(b"\n") + 1
+        self.pending = data[end:]
+        if end:
+            self.file.write(encode_block(data[:end].decode("utf-8")))
+
+    def close(self):
+        if self.pending:
+            self.file.write(encode_block(self.pending.decode("utf-8")))
+            self.pending = b""
+        self.file.close()
+
+
+def iter_decode(file):
+    """
+    Reads a binary Gcode file block by block and yields the decoded text.
+    Raises ValueError if a block is damaged.
+    """
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a binary Gcode file")
+    while True:
+        header = file.read(BLOCK_HEADER.size)
+        if not header:
+            return
+        if len(header) < BLOCK_HEADER.size:
+            raise ValueError("Truncated binary Gcode block")
+        size, compressed, crc = BLOCK_HEADER.unpack(header)
+        try:
+            payload = zlib.decompress(file.read(compressed))
+            text = decode_block(payload) if len(payload) == size else None
+        except (zlib.error, IndexError, UnicodeDecodeError) as e:
+            raise ValueError(f"Damaged binary Gcode block: {e}")
+        if text is None:
+            raise ValueError("Damaged binary Gcode block (size mismatch)")
+        if zlib.crc32(text.encode("utf-8")) != crc:
+            raise ValueError("Damaged binary Gcode block (checksum mismatch)")
+        yield text
+
+
+def decode_file(source, target):
+    """
+    Rebuilds the plain text Gcode file from a binary Gcode file
+
+    Arguments
+        source: path of the binary file
+        target: path of the text file to write
+    Returns
+        target
+    """
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        for text in iter_decode(src):
+            dst.write(text.encode("utf-8"))
+    return target
@@ -1,6 +1,10 @@
 
-import rhinoscriptsyntax as rs
+try:
+    import rhinoscriptsyntax as rs
+except ImportError:  # running outside Rhino, see backendlib
+    rs = None
 import geometrylib as gl
+from backendlib import get_backend
 
 
 def tween2crv(crv0, crv1):
@@ -9,17 +13,18 @@ def tween2crv(crv0, crv1):
 
 
 def midpt(pt0, pt1):
-    """ Returns the midpoint from two given points"""
-    x = (pt0.X + pt1.X) / 2
-    y = (pt0.Y + pt1.Y) / 2
-    z = (pt0.Z + pt1.Z) / 2
-    return(rs.AddPoint(x, y, z))
+    """ Returns the midpoint from two given points (not a document object)"""
+    x = (pt0[0] + pt1[0]) / 2
+    y = (pt0[1] + pt1[1]) / 2
+    z = (pt0[2] + pt1[2]) / 2
+    return(get_backend().point(x, y, z))
 
 
 def divcrvlen(crv, dist):
-    len = rs.CurveLength(crv)
+    backend = get_backend()
+    len = backend.curve_length(crv)
     divlen = round(len / dist)
-    curve = rs.DivideCurve(crv, divlen)
+    curve = backend.divide_curve(crv, divlen)
     return(curve)
 
 
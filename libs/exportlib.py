@@ -0,0 +1,292 @@
+"""Export pipelines shared by the Grasshopper exporters and the batch exporter
+
+Turn arrays of points and velocities into Gcode (Ultimaker 2+, Wasp) or KRL (KUKA).
+Works without Rhino.
+"""
+
+__author__ = "jose hernandez vargas"
+__version__ = "2024-09-02"
+
+import numpy as np
+import printlib as pl
+import toolpathlib as tl
+import arclib as al
+from geometrylib import unwrap_abc
+
+FILAMENT = 2.85
+
+# machine specific gcode and settings, taken from the exporter scripts
+PROFILES = {
+    "wasp": {
+        "start": [
+            "G21 ;metric values",
+            "G90 ;absolute positioning",
+            "M82 ;set extruder to absolute mode",
+            "M107 ;start with the fan off",
+            "G28 X0 Y0 ;move X/Y to min endstops",
+            "G28 Z0 ;move Z to min endstops",
+            "T0",
+            "G92 E0 ;zero the extruded length",
+            "M140 S40; print bed", # sets up the bed temperature without waiting
+            "M109 S200; print head", # sets up the printhead temperatire and waits
+            "G0 F9000 X0 Y0 Z20",
+        ],
+        "end": [
+            "G10",
+            ";M82 ;absolute extrusion mode",
+            "",
+            ";End of Gcode",
+            "M104 S0  ;extruder heater off",
+            "M140 S0  ;heated bed heater off",
+            "G91  ;relative positioning",
+            "G1 E-1 F300   ;retract the filament a bit",
+            "G1 Z+1 E-5 F9000 ;move Z up a bit and retract filament even more",
+            "M107  ;fan off",
+            "G28 ;move X/Y to min endstops, so the head is out of the way",
+            ";M84 ;steppers off",
+            "G90 ;absolute positioning",
+        ],
+        "first_feed": None,  # feedrate of the travel to the first point, None uses the first block's
+        "feeds": (600, 900),  # feedrate below and above fan_height
+        "fan_height": 2,  # fans on, faster and without extra adhesion flow from this height
+        "adhesion": True,  # extra flow below fan_height
+        "overflow": True,  # flow multiplies the material flow
+        "time": "hms",  # ;TIME as hh:mm:ss
+    },
+    "ultimaker2": {
+        "start": [
+            "G92 E0",
+            "M109 S205",
+            "G0 F12000 X5 Y5 Z20",
+            "G280",
+            "G10",
+        ],
+        "end": [
+            "G10",
+            "M107; turn fans off",
+            ";M82 ;absolute extrusion mode",
+            ";End of Gcode",
+        ],
+        "first_feed": 3600,
+        "feeds": (600, 600),
+        "fan_height": 2,
+        "adhesion": False,
+        "overflow": False,
+        "time": "seconds",  # ;TIME in seconds, as UltiGCode expects
+    },
+}
+
+
+def load_toolpath(path, velocity=1.0):
+    """
+    Reads a toolpath exported from Grasshopper, a .npy array or a text file
+    (.csv / .txt) with one point per line: x, y, z and optionally the velocity
+
+    Arguments
+        path: file path
+        velocity: velocity of the points of a file without velocity column, e.g. 1
+            as the flow multiplier of Gcode. None requires the column (robot
+            velocities in mm/s have no sensible default)
+    Returns
+        (N x 3 points, N velocities)
+    """
+    if path.endswith(".npy"):
+        data = np.load(path)
+    else:
+        data = np.loadtxt(path, delimiter="," if path.endswith(".csv") else None, ndmin=2)
+    data = np.asarray(data, dtype=float)
+    if data.ndim != 2 or data.shape[1] not in (3, 4):
+        raise ValueError(f"{path}: expected 3 or 4 columns (x, y, z, velocity)")
+    if data.shape[1] == 4:
+        return data[:, :3], data[:, 3]
+    if velocity is None:
+        raise ValueError(f"{path}: expected 4 columns (x, y, z, velocity in mm/s)")
+    return data[:, :3], np.full(len(data), float(velocity))
+
+
+def gcode_toolpath(gcode, profile, pts, vel, nozzle, layerheight, flow,
+                   decimate_tolerance=0, arc_tolerance=0, model="velocity",
+                   clearance=None, layers=None):
+    """
+    Adds the start gcode, the toolpath and the end gcode to a GCodeLib,
+    and the estimated printing time to its header (run add_header() first)
+
+    Arguments
+        gcode: GCodeLib (with a list of commands or an open stream)
+        profile: name of the machine in PROFILES
+        pts: N x 3 points, already placed on the buildplate
+        vel: N velocities, flow multiplier of each point
+        nozzle: nozzle diameter
+        layerheight: layer height
+        flow: overflow factor
+        decimate_tolerance: removes collinear points within this deviation (0 = off)
+        arc_tolerance: writes G2 / G3 arcs within this chord tolerance (0 = off)
+        model: flow model of toolpathlib.extrusion ("velocity", "constant" or "clearance")
+        clearance: N clearance distances for the "clearance" model (optional)
+        layers: N layer numbers, e.g. one per curve. Every layer starts with a
+            travel without extrusion and ;LAYER comments (None = one continuous path)
+    Returns
+        dict with the points, velocities, extrusion, feeds, print time and time per layer
+    """
+    settings = PROFILES[profile]
+    pts = tl.as_points(pts)
+    vel = np.asarray(vel, dtype=float)
+    if len(pts) != len(vel):
+        raise ValueError("The PTS and VEL lists have different lengths")
+    if layers is not None:
+        layers = np.asarray(layers)
+    if clearance is not None:
+        clearance = np.asarray(clearance, dtype=float)
+
+    # simplify the toolpath within a tolerance, keeping the points where the velocity
+    # or the layer changes
+    if decimate_tolerance:
+        attributes = [vel] if layers is None else [vel, layers]
+        keep = tl.decimate(pts, decimate_tolerance, attributes)
+        pts, vel = pts[keep], vel[keep]
+        layers = None if layers is None else layers[keep]
+        clearance = None if clearance is None else clearance[keep]
+    n = len(pts)
+
+    materialflow = pl.caluclate_flow(nozzle, layerheight, FILAMENT)
+    if settings["overflow"]:
+        materialflow = materialflow / 10 * flow
+
+    # absolute extrusion for all the points, extra flow below fan_height for adhesion
+    adhesion = pts[:, 2] < settings["fan_height"] if settings["adhesion"] else None
+    e = tl.extrusion(pts, materialflow, model, vel=vel, clearance=clearance, nozzle=nozzle,
+                     adhesion=adhesion)
+    layer_starts = []
+    if layers is not None and n:
+        layer_starts = np.flatnonzero(np.r_[True, layers[1:] != layers[:-1]])
+        # no extrusion on the travel to the start of every layer
+        increments = np.diff(e, prepend=e[0])
+        increments[layer_starts] = 0
+        e = np.cumsum(increments) + e[0]
+
+    # start slower, with extra extrusion and without fans
+    # the fans start and the speed goes up once the printing height is reached
+    above = np.flatnonzero(pts[:, 2] >= settings["fan_height"])
+    fan = int(above[0]) if len(above) else n
+    slow, fast = settings["feeds"]
+    feeds = np.where(np.arange(n) < fan, slow, fast)
+    if settings["first_feed"] is not None:
+        feeds[0] = settings["first_feed"]
+
+    gcode.commands.extend(settings["start"])
+    if fan == 0:
+        gcode.commands.append("M106; Turn fans on")
+
+    def comments(start):
+        """layer comments of a layer starting at a point"""
+        if layers is None or start not in layer_starts:
+            return []
+        return [";TYPE:WALL-OUTER", f";LAYER_COUNT:{len(layer_starts)}",
+                f";LAYER:{np.searchsorted(layer_starts, start)}"]
+
+    if n:
+        gcode.commands.extend(comments(0))
+        # first point
+        gcode.commands.append("G11") # unretract
+        state = {} # last written words, only the changing ones are written
+        gcode.commands.append(pl.gcodeblock(0, pts[:1], f=feeds[0], state=state))
+
+    def block(start, end, f):
+        """gcode for the points from start to end (excluded), fitting arcs if enabled"""
+        if arc_tolerance:
+            return al.gcodearcs(pts[start - 1:end], e[start - 1:end], f, arc_tolerance)
+        return pl.gcodeblock(0, pts[start:end], f=f, e=e[start:end], state=state)
+
+    # the rest of the toolpath in one block per feedrate and layer
+    bounds = sorted(set([1, n] + [fan] * (0 < fan < n) + [int(i) for i in layer_starts if i > 0]))
+    for start, end in zip(bounds, bounds[1:]):
+        if start == fan:
+            gcode.commands.append("M106; Turn fans on") # turn on the fans after first layer
+        gcode.commands.extend(comments(start))
+        gcode.commands.append(block(start, end, slow if start < fan else fast))
+    gcode.commands.extend(settings["end"])
+
+    # time estimation with the acceleration limits of the machine
+    total, layer_times = tl.print_time(pts, feeds, gcode.machine, layers)
+    secs = int(total)
+    if settings["time"] == "hms":
+        gcode.header.insert(1, f"; TIME: {secs//3600:02}:{(secs%3600)//60:02}:{secs%60:02}")
+    else:
+        gcode.header.insert(1, f";TIME:{total:.0f}")
+
+    return {"points": pts, "velocities": vel, "extrusion": e, "feeds": feeds,
+            "time": secs, "layer_times": layer_times}
+
+
+def krl_poses(pts, startpt, abc=None):
+    """
+    Every pose krl_toolpath moves to, in order: the approach, the printing
+    moves, the rise and the exit. For the reachability check (see robotlib)
+
+    Arguments
+        pts: N x 3 points
+        startpt: x, y of the approach point
+        abc: N x 3 tool orientations, 0, 0, 0 if None
+    Returns
+        (N + 3) x 6 array of X, Y, Z, A, B, C
+    """
+    pts = tl.as_points(pts)
+    abc = np.zeros((len(pts), 3)) if abc is None else np.asarray(abc, dtype=float).reshape(-1, 3)
+    top = pts[-1, 2] if len(pts) else 0.0
+    approach = [startpt[0], startpt[1], 50.0, 0, 0, 0] #HACK: hardcoded 50 mm height for first point
+    rise = [startpt[0], startpt[1], top + 50, 0, 0, 0]
+    end = [startpt[0], startpt[1], top, 0, 0, 0]
+    return np.vstack(([approach], np.column_stack((pts, abc)).reshape(-1, 6), [rise, end]))
+
+
+def krl_toolpath(krl, pts, vel, startpt, spline=0, abc=None):
+    """
+    Adds a printing toolpath to a KukaKRL program, after its header.
+    The robot approaches from startpt at 50 mm height, switches the extruder
+    ($OUT[3]) on, follows the points and rises 50 mm over startpt at the end.
+
+    Arguments
+        krl: KukaKRL
+        pts: N x 3 points
+        vel: N velocities in mm/s
+        startpt: x, y of the approach point
+        spline: maximum points per SPLINE block, 0 writes LIN moves
+        abc: N x 3 tool orientations (see geometrylib.planes_to_abc), 0, 0, 0 if None.
+            SPLINE blocks blend the orientations, so they are unwrapped along the path
+    Returns
+        list with the points of the robot path, for a preview
+    """
+    pts = tl.as_points(pts)
+    # velocity in m/s, every value rounded with round() as before (np.round differs on some halves)
+    vels = np.array([round(v / 1000, 3) for v in np.asarray(vel, dtype=float).tolist()])
+    if len(pts) != len(vels):
+        raise ValueError("The PTS and VEL lists have different lengths")
+    if spline and abc is not None:
+        abc = unwrap_abc(abc)
+    # Starting points outside of the build plate
+    poses = krl_poses(pts, startpt, abc)
+    approach, rise, end = poses[0].tolist(), poses[-2].tolist(), poses[-1].tolist()
+
+    krl.code.append(";FOLD LIN SPEED IS {} m/sec, INTERPOLATION SETTINGS IN FOLD".format(vels[0]))
+    krl.code.append("$VEL.CP={}".format(vels[0]))
+    krl.code.append("$ADVANCE=3")
+    krl.code.append(";ENDFOLD")
+    krl.velocity = vels[0].item()
+    krl.code.append("$OUT[3]=FALSE")
+    krl.lin(approach)
+
+    # all the printing moves, $VEL.CP where the velocity changes
+    if spline:
+        krl.spline_block(poses[1:-2], vels, max_points=spline)
+    else:
+        krl.lin_block(poses[1:-2], vels)
+    krl.code.append("$OUT[3]=TRUE")
+
+    # Rise the nozzle quickly after the last point
+    krl.set_velocity(0.25)
+    krl.lin(rise)
+    # Add a last exit point after the print
+    krl.lin(end)
+    krl.code.append("$OUT[3]=FALSE")
+
+    return [tuple(pt) for pt in poses[:, :3].tolist()]
@@ -1,35 +1,99 @@
 # libs/gcodelib.py
 import time
-import rhinoscriptsyntax as rs
 import json
 import os
 import math
+import shutil
+import gzip
+from contextlib import contextmanager
+import bgcodelib
+from backendlib import get_backend
+
+# bytes reserved at the start of a streamed file for the final header
+HEADER_RESERVE = 4096
+# size of the chunks written to disk by GCodeSink
+CHUNK_SIZE = 1 << 20
+# file extension of each output mode
+EXTENSIONS = {None: ".gcode", "gzip": ".gcode.gz", "binary": ".bgc"}
+
+
+class GCodeSink:
+    """
+    Buffered line sink that writes Gcode to an open binary file in large chunks.
+    Behaves like the commands list (append / extend) so it can replace it.
+    """
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.size = 0
+        self.lines = 0
+
+    def append(self, line):
+        """Adds a line, flushing the buffer to disk when it exceeds the chunk size."""
+        self.buffer.append(line)
+        self.size += len(line) + 1
+        self.lines += 1
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def extend(self, lines):
+        """Adds several lines."""
+        for line in lines:
+            self.append(line)
+
+    def flush(self):
+        """Writes the buffered lines to the file."""
+        if self.buffer:
+            self.file.write(("\n".join(self.buffer) + "\n").encode("utf-8"))
+            self.buffer = []
+            self.size = 0
+
+    def __len__(self):
+        return self.lines
+
+
+def machine_file_path(machine_file):
+    """
+    Returns the path of a machine configuration file in machine_settings.
+
+    Parameters:
+    machine_file (str): The name of the machine configuration file (without extension).
+    """
+    # Locate the path of the current file (gcodelib.py)
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir = os.path.dirname(current_dir)
+
+    # Define the fixed machine_properties folder relative to gcodelib.py
+    machine_folder = 'machine_settings'
+
+    # Construct the full path to the machine JSON file
+    return os.path.join(parent_dir, machine_folder, f'{machine_file}.json')
+
 
 class GCodeLib:
-    def __init__(self, filename, machine_file):
+    def __init__(self, filename, machine_file, created=None):
         """
         Initialize the GcodeHandler with a filename to write the Gcode commands.
         
         Parameters:
         filename (str): The name of the Gcode file to write.
         machine (str): The name of the machine configuration file (without extension).
+        created (time.struct_time): Date for the file name and the header, defaults
+            to the current time. Set it to get reproducible files.
         """
         self.filename = filename
+        self.created = created
 
-        # Locate the path of the current file (gcodelib.py)
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        parent_dir = os.path.dirname(current_dir) 
-
-        # Define the fixed machine_properties folder relative to gcodelib.py
-        machine_folder = 'machine_settings'
-
-        # Construct the full path to the machine JSON file
-        machine_file = os.path.join(parent_dir, machine_folder, f'{machine_file}.json')
+        machine_file = machine_file_path(machine_file)
         
         # Load machine properties
         self.machine = self.load_machine_properties(machine_file)
         self.header = []
         self.commands = []
+        self.part = None
+        self.stream = None
         self.minx = self.miny = self.minz = self.maxx = self.maxy = self.maxz = None
     
     def load_machine_properties(self, machine_file: str) -> dict:
@@ -49,6 +113,14 @@ class GCodeLib:
         except (FileNotFoundError, json.JSONDecodeError) as e:
             raise ValueError(f"Error loading machine properties: {e}")
 
+    def strftime(self, format):
+        """
+        Formats the creation date (or the current time if it is not set).
+        """
+        if self.created is None:
+            return time.strftime(format)
+        return time.strftime(format, self.created)
+
     def add_comment(self, comment):
         """
         Add a comment to the Gcode file.
@@ -64,7 +136,7 @@ class GCodeLib:
         """
         self.part = geometry
 
-        bbox = rs.BoundingBox(geometry)
+        bbox = get_backend().bounding_box(geometry)
         if bbox:
             self.minx = bbox[0][0]
             self.miny = bbox[0][1]
@@ -99,8 +171,8 @@ class GCodeLib:
             raise ValueError("Part dimensions not set. Please run get_part_dims() before adding a header.")
 
         
-        timestamp = time.strftime("%Y%m%d")  # adds a timestamp with the date
-        hourstamp = " at " + time.strftime("%X")  # a timestamp with the hour
+        timestamp = self.strftime("%Y%m%d")  # adds a timestamp with the date
+        hourstamp = " at " + self.strftime("%X")  # a timestamp with the hour
 
         self.header = [
         f";FLAVOR:{self.machine['gcode_flavour']}",
@@ -121,18 +193,152 @@ class GCodeLib:
         ";END_OF_HEADER"
         ]
 
-    def save(self):
+    def filepath(self, folder, extension=".gcode"):
         """
-        Save the Gcode commands to the file
+        Returns the path of the Gcode file in a folder, prefixed with the date.
         """
-        extension = '.gcode'
-        timestamp = time.strftime("%Y%m%d")  # adds a timestamp with the date
+        timestamp = self.strftime("%Y%m%d")  # adds a timestamp with the date
+        return os.path.join(folder, f"{timestamp}_{self.filename}{extension}")
 
-        file += '\\' + timestamp + "_" + self.filename + extension
-        
-        with open(file, 'w') as file:
-            for line in self.header:
-                file.write(f"{line}\n")
-            for command in self.commands:
-                file.write(f"{command}\n")
+    def save(self, folder):
+        """
+        Save the header and the Gcode commands to a file in the folder
+
+        Returns:
+        str: The path of the saved file.
+        """
+        path = self.filepath(folder)
+        with open(path, 'wb') as file:
+            sink = GCodeSink(file)
+            sink.extend(self.header)
+            sink.extend(self.commands)
+            sink.flush()
+        return path
 
+    def open_stream(self, folder, reserve=HEADER_RESERVE, chunk_size=CHUNK_SIZE, compression=None):
+        """
+        Streaming mode: from now on the commands are written to disk in chunks as
+        they are added, instead of being kept in memory.
+        The header is written by close_stream() with the final values (MINX, MAXZ, TIME...).
+        Plain files reserve space for it at the start of the file, compressed files
+        stream the commands to a temporary file that is appended after the header.
+
+        Parameters:
+        folder (str): The folder of the Gcode file.
+        reserve (int): Bytes reserved for the header.
+        chunk_size (int): Size in bytes of the chunks written to disk.
+        compression (str): None for plain text, "gzip", or "binary" for the delta
+            coded format of bgcodelib (decode it with bgcodelib.decode_file).
+
+        Returns:
+        str: The path of the file.
+        """
+        if compression not in EXTENSIONS:
+            raise ValueError(f"Unknown compression '{compression}'. Use one of {list(EXTENSIONS)}")
+        path = self.filepath(folder, EXTENSIONS[compression])
+        if compression is None:
+            raw = file = open(path, 'wb')
+            file.write(b" " * (reserve - 1) + b"\n")
+        else:
+            raw = open(path + ".tmp", 'wb')
+            if compression == "gzip":
+                file = gzip.GzipFile(fileobj=raw, mode='wb', mtime=0)
+            else:
+                file = bgcodelib.BinaryGCodeWriter(raw, magic=False)
+        self.stream = {"path": path, "reserve": reserve, "compression": compression, "raw": raw}
+        # lines added before opening the stream go first
+        sink = GCodeSink(file, chunk_size)
+        sink.extend(self.commands)
+        self.commands = sink
+        return path
+
+    def close_stream(self):
+        """
+        Flushes the remaining commands and writes the header.
+        If the header does not fit in the reserved space of a plain file, the file
+        is rewritten through a temporary file.
+
+        Returns:
+        str: The path of the file.
+        """
+        if self.stream is None:
+            raise ValueError("No open stream. Please run open_stream() first.")
+        path = self.stream["path"]
+        reserve = self.stream["reserve"]
+        compression = self.stream["compression"]
+        sink = self.commands
+        sink.flush()
+        file = sink.file
+        header = ("\n".join(self.header) + "\n").encode("utf-8")
+        padding = reserve - len(header)
+        if compression is None and (padding == 0 or padding >= 2):
+            # pad with short comment lines so the reserved block stays valid Gcode
+            while padding:
+                size = min(padding, 80)
+                if padding - size == 1:
+                    size -= 1
+                header += b";" + b" " * (size - 2) + b"\n"
+                padding -= size
+            file.seek(0)
+            file.write(header)
+            file.close()
+        else:
+            file.close()
+            self.stream["raw"].close()
+            temp = path + ".tmp"
+            if compression is None:
+                os.replace(path, temp)
+            with open(temp, 'rb') as src, open(path, 'wb') as dst:
+                if compression == "gzip":
+                    # concatenated gzip members decompress as a single stream
+                    dst.write(gzip.compress(header, mtime=0))
+                elif compression == "binary":
+                    dst.write(bgcodelib.MAGIC + bgcodelib.encode_block(header.decode("utf-8")))
+                else:
+                    dst.write(header)
+                    src.seek(reserve)
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            os.remove(temp)
+        self.stream = None
+        self.commands = []
+        return path
+
+    def abort_stream(self):
+        """
+        Closes an open stream without writing the header and removes the
+        half-written file, e.g. when the toolpath fails.
+        """
+        if self.stream is None:
+            return
+        path = self.stream["path"]
+        self.commands.file.close()
+        self.stream["raw"].close()
+        for name in (path, path + ".tmp"):
+            if os.path.exists(name):
+                os.remove(name)
+        self.stream = None
+        self.commands = []
+
+    @contextmanager
+    def streaming(self, folder, **options):
+        """
+        open_stream() for a with block: the header is written at the end of the
+        block, or the file is removed if the block fails.
+
+            with gcode.streaming(folder) as path:
+                exportlib.gcode_toolpath(gcode, ...)
+
+        Parameters:
+        folder (str): The folder of the Gcode file.
+        options: reserve, chunk_size and compression of open_stream()
+
+        Returns:
+        str: The path of the file.
+        """
+        path = self.open_stream(folder, **options)
+        try:
+            yield path
+        except BaseException:
+            self.abort_stream()
+            raise
+        self.close_stream()
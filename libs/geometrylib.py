@@ -1,5 +1,10 @@
 import math
-import rhinoscriptsyntax as rs
+import numpy as np
+try:
+    import rhinoscriptsyntax as rs
+except ImportError:  # running outside Rhino, see backendlib
+    rs = None
+from backendlib import get_backend
 
 
 def lerp(a, b, t):
@@ -25,11 +30,11 @@ def remap(imin, imax, omin, omax, v):
 def lerppts( a , b , t):
     """"
     Creates a linear interpolation between two points
-    Returns the value for a parameter t in the range a - b"""
+    Returns the point for a parameter t in the range a - b (not a document object)"""
     x = (( 1 - t ) * a[0] + b[0] * t )
-    y = (( 1 - t ) * a.Y + b.Y * t )
-    z = (( 1 - t ) * a.Z + b.Z * t )
-    return (rs.AddPoint(x,y,z))
+    y = (( 1 - t ) * a[1] + b[1] * t )
+    z = (( 1 - t ) * a[2] + b[2] * t )
+    return (get_backend().point(x,y,z))
 
 def minmaxcaplist(lo, hi, t):
     """Clamps a value between two limits"""
@@ -49,9 +54,10 @@ def minmaxcap(lo, hi, t):
 def flattenlist(list):
     """flattens a nested list into a simple list"""
     flatlist = []
+    backend = get_backend()
     for i in list:
         for j in i:
-            point = rs.CreatePoint(j)
+            point = backend.point(j[0], j[1], j[2])
             flatlist.append(point)
     return(flatlist)
 
@@ -150,4 +156,50 @@ def plane_to_abc(origin, x_vector, y_vector):
     if yaw > 350:
         yaw -= 360
 
-    return yaw, pitch, roll
\ No newline at end of file
+    return yaw, pitch, roll
+
+
+def unwrap_abc(abc):
+    """
+    Removes the 360 degree jumps between consecutive A, B, C angles, so the wrist
+    does not spin around along the path (the first frame keeps its range)
+    Arguments
+        abc: N x 3 angles in degrees
+    Returns
+        N x 3 array
+    """
+    abc = np.asarray(abc, dtype=float).reshape(-1, 3)
+    if len(abc) < 2:
+        return abc
+    return np.degrees(np.unwrap(np.radians(abc), axis=0))
+
+
+def planes_to_abc(x_vectors, y_vectors, unwrap=False):
+    """
+    Converts frames to KUKA A, B, C angles, the array version of plane_to_abc
+    (same angles and ranges for each frame)
+    Arguments
+        x_vectors: N x 3 X axes of the frames
+        y_vectors: N x 3 Y axes of the frames
+        unwrap: continuous angles along the path (see unwrap_abc) instead of the
+            ranges of plane_to_abc, for SPLINE blocks
+    Returns
+        N x 3 array with A, B, C in degrees
+    """
+    x = np.asarray(x_vectors, dtype=float).reshape(-1, 3)
+    y = np.asarray(y_vectors, dtype=float).reshape(-1, 3)
+    z = np.cross(x, y)
+    z /= np.linalg.norm(z, axis=1)[:, None]
+
+    # rotation matrix columns are x, y, z
+    roll = np.degrees(np.arctan2(y[:, 2], z[:, 2])) % 360
+    pitch = np.degrees(np.arctan2(-x[:, 2], np.hypot(y[:, 2], z[:, 2]))) % 360
+    yaw = np.degrees(np.arctan2(x[:, 1], x[:, 0])) % 360
+
+    # Adjust angle ranges
+    roll[roll > 185] -= 360
+    pitch[pitch > 135] -= 360
+    yaw[yaw > 350] -= 360
+
+    abc = np.column_stack((yaw, pitch, roll))
+    return unwrap_abc(abc) if unwrap else abc
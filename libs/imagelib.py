@@ -0,0 +1,208 @@
+"""Image sampling for image projection
+
+Images are decoded once into a lightness array (0 black to 1 white, the L of
+rs.ColorRGBToHLS) and cached by path and modification time, so Grasshopper
+solves reuse them. Lookups take arrays of UV coordinates.
+
+    import imagelib as il
+    image = il.load_image(image_path)
+    sizes = image.sample(u, v, "bilinear")
+    # average over the footprint of the nozzle, 0.01 x 0.02 of the image
+    sizes = image.sample(u, v, footprint=(0.01, 0.02))
+
+Inside Rhino the images are decoded with System.Drawing, outside with Pillow
+(if installed). .npy files with a 2D array of lightness values work everywhere.
+"""
+
+__author__ = "jose hernandez vargas"
+__version__ = "2024-09-02"
+
+import ctypes
+import os
+import numpy as np
+
+try:
+    from System.Drawing import Bitmap, Rectangle
+    from System.Drawing.Imaging import ImageLockMode, PixelFormat
+except ImportError:  # running outside Rhino
+    Bitmap = None
+
+try:
+    from PIL import Image
+except ImportError:  # optional, to read images outside Rhino
+    Image = None
+
+# decoded images by (path, modification time)
+_cache = {}
+
+
+def lightness(rgb):
+    """
+    HSL lightness of an array of colours
+
+    Arguments
+        rgb: ... x 3 array of red, green, blue (0 - 255)
+    Returns
+        ... array of lightness values from 0 (black) to 1 (white)
+    """
+    rgb = np.asarray(rgb, dtype=np.float32)
+    return (rgb.max(axis=-1) + rgb.min(axis=-1)) / (2 * 255)
+
+
+def _read_bitmap(path):
+    """rows x columns x 3 RGB array of an image, decoded with System.Drawing"""
+    bitmap = Bitmap(path)
+    try:
+        width, height = bitmap.Width, bitmap.Height
+        data = bitmap.LockBits(Rectangle(0, 0, width, height), ImageLockMode.ReadOnly,
+                               PixelFormat.Format32bppArgb)
+        try:
+            raw = ctypes.string_at(data.Scan0.ToInt64(), data.Stride * height)
+            stride = data.Stride
+        finally:
+            bitmap.UnlockBits(data)
+    finally:
+        bitmap.Dispose()
+    # the pixels are stored as blue, green, red, alpha
+    pixels = np.frombuffer(raw, dtype=np.uint8).reshape(height, stride // 4, 4)[:, :width]
+    return pixels[:, :, 2::-1]
+
+
+def read_image(path):
+    """
+    Decodes an image file to a lightness array (rows x columns, row 0 at the top)
+
+    Arguments
+        path: image file, or .npy file with a 2D array of values from 0 to 1
+    Returns
+        2D float32 array
+    """
+    if path.endswith(".npy"):
+        return np.asarray(np.load(path), dtype=np.float32)
+    if Bitmap is not None:
+        return lightness(_read_bitmap(path))
+    if Image is not None:
+        with Image.open(path) as img:
+            return lightness(np.asarray(img.convert("RGB")))
+    raise ImportError("Reading images needs System.Drawing (Rhino) or Pillow")
+
+
+class ImageSampler:
+    """
+    Lightness lookups on a decoded image.
+    UV coordinates go from 0 to 1 over the image, U to the right and V up
+    (V = 0 is the bottom row), as the surface domain is mapped in img_projection.
+    """
+
+    def __init__(self, values):
+        """
+        Parameters:
+        values (array): rows x columns lightness values, row 0 at the top
+        """
+        self.values = np.asarray(values, dtype=np.float32)
+        self.height, self.width = self.values.shape
+        self._levels = None
+
+    @property
+    def levels(self):
+        """
+        Mip pyramid, built on first use: level 0 is the image and every next level
+        averages 2 x 2 pixels of the previous one, down to a single pixel
+        """
+        if self._levels is None:
+            levels = [self.values]
+            while max(levels[-1].shape) > 1:
+                level = levels[-1]
+                # odd sizes repeat the last row / column
+                level = np.pad(level, ((0, level.shape[0] % 2), (0, level.shape[1] % 2)), mode="edge")
+                levels.append(0.25 * (level[0::2, 0::2] + level[1::2, 0::2]
+                                      + level[0::2, 1::2] + level[1::2, 1::2]))
+            self._levels = levels
+        return self._levels
+
+    def pixel_coordinates(self, u, v):
+        """column and row (floats) of UV coordinates, clamped to the image"""
+        x = np.clip(np.asarray(u, dtype=float), 0, 1) * (self.width - 1)
+        y = (1 - np.clip(np.asarray(v, dtype=float), 0, 1)) * (self.height - 1)
+        return x, y
+
+    def sample(self, u, v, filter="nearest", footprint=None):
+        """
+        Lightness at arrays of UV coordinates
+
+        Parameters:
+        u, v (array): coordinates from 0 to 1
+        filter (str): "nearest" pixel or "bilinear" interpolation
+        footprint: size of the sampled area in UV (a value, or U and V sizes, each
+            a value or an array per point). The image is averaged over it by
+            interpolating between the levels of the mip pyramid, the filter is ignored
+
+        Returns:
+        array: values from 0 (black) to 1 (white)
+        """
+        if footprint is not None:
+            return self._sample_area(u, v, footprint)
+        return self._sample(self.values, u, v, filter)
+
+    @staticmethod
+    def _sample(values, u, v, filter):
+        """sample() of one level of the pyramid"""
+        height, width = values.shape
+        x = np.clip(np.asarray(u, dtype=float), 0, 1) * (width - 1)
+        y = (1 - np.clip(np.asarray(v, dtype=float), 0, 1)) * (height - 1)
+        if filter == "nearest":
+            return values[np.round(y).astype(np.intp), np.round(x).astype(np.intp)]
+        if filter != "bilinear":
+            raise ValueError(f"Unknown filter '{filter}', use nearest or bilinear")
+        x0 = np.clip(np.floor(x).astype(np.intp), 0, max(width - 2, 0))
+        y0 = np.clip(np.floor(y).astype(np.intp), 0, max(height - 2, 0))
+        x1 = np.minimum(x0 + 1, width - 1)
+        y1 = np.minimum(y0 + 1, height - 1)
+        fx = x - x0
+        fy = y - y0
+        top = values[y0, x0] * (1 - fx) + values[y0, x1] * fx
+        bottom = values[y1, x0] * (1 - fx) + values[y1, x1] * fx
+        return top * (1 - fy) + bottom * fy
+
+    def _sample_area(self, u, v, footprint):
+        """average over a footprint, trilinear between the two closest pyramid levels"""
+        u = np.asarray(u, dtype=float)
+        v = np.asarray(v, dtype=float)
+        fu, fv = np.broadcast_to(np.asarray(footprint, dtype=float), (2,) + np.shape(footprint)[1:])
+        # level whose pixels are as large as the footprint
+        pixels = np.maximum(np.maximum(fu * self.width, fv * self.height), 1)
+        level = np.clip(np.log2(pixels), 0, len(self.levels) - 1)
+        level = np.broadcast_to(level, np.broadcast(u, v).shape)
+        lower = np.floor(level).astype(np.intp)
+        result = np.zeros(level.shape, dtype=np.float32)
+        # each point only samples the two levels around it
+        for l in np.unique(lower).tolist():
+            idx = np.nonzero(lower == l)
+            uu = np.broadcast_to(u, level.shape)[idx]
+            vv = np.broadcast_to(v, level.shape)[idx]
+            value = self._sample(self.levels[l], uu, vv, "bilinear")
+            if l + 1 < len(self.levels):
+                f = level[idx] - l
+                value = value * (1 - f) + self._sample(self.levels[l + 1], uu, vv, "bilinear") * f
+            result[idx] = value
+        return result
+
+
+def load_image(path):
+    """
+    Returns the ImageSampler of an image file, decoding it only if it is not in
+    the cache or it changed on disk
+
+    Arguments
+        path: image file (or .npy lightness array)
+    Returns
+        ImageSampler
+    """
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path))
+    if key not in _cache:
+        # drop older versions of the same file
+        for old in [k for k in _cache if k[0] == path]:
+            del _cache[old]
+        _cache[key] = ImageSampler(read_image(path))
+    return _cache[key]
@@ -6,13 +6,200 @@
 __author__ = "jose hernandez vargas"
 __version__ = "2024-06-26"
 
+import os
+import numpy as np
+
+# motion blocks, the same format as lin() and ptp() (the axis angles as str() writes them)
+LIN_FORMAT = "LIN {X %.1f, Y %.1f, Z %.1f, A %.2f, B %.2f, C %.2f, E1 0, E2 0} C_DIS"
+SEGMENT_FORMAT = " {X %.1f, Y %.1f, Z %.1f, A %.2f, B %.2f, C %.2f, E1 0, E2 0}"  # after SPL / SLIN
+PTP_FORMAT = "PTP {A1 %s, A2 %s, A3 %s, A4 %s, A5 %s, A6 %s, E1 0, E2 0, E3 0, E4 0, E5 0, E6 0}"
+
+
+def format_blocks(template, values):
+    """
+    Formats one block per row of an N x 6 array in a single pass
+
+    Arguments
+        template: block format with six % fields
+        values: N x 6 array
+    Returns
+        list of N lines
+    """
+    values = np.asarray(values, dtype=float).reshape(-1, 6)
+    if not len(values):
+        return []
+    return ((template + "\n") * len(values) % tuple(values.ravel().tolist()))[:-1].split("\n")
+
+
+def resample_time(pts, vel, interval, corner_angle=5):
+    """
+    Resamples a toolpath so every move takes the same time at its velocity.
+    The velocity changes linearly with the arc length between the points,
+    and the new points get the velocity of the path where they lie.
+
+    Arguments
+        pts: N x 3 points
+        vel: N velocities (mm/s)
+        interval: time between points in seconds
+        corner_angle: points where the path turns more than this angle (degrees)
+            are kept, None resamples straight through the corners
+    Returns
+        (M x 3 points, M velocities), with the first and last points of the toolpath
+    """
+    if not isinstance(pts, np.ndarray):
+        pts = [(pt[0], pt[1], pt[2]) for pt in pts]  # Point3d lists
+    pts = np.asarray(pts, dtype=float).reshape(-1, 3)
+    vel = np.asarray(vel, dtype=float)
+    if len(vel) != len(pts):
+        raise ValueError("There must be one velocity per point.")
+    if interval <= 0:
+        raise ValueError("The interval must be positive.")
+    # without repeated points
+    keep = np.concatenate(([True], np.linalg.norm(np.diff(pts, axis=0), axis=1) > 0))
+    pts, vel = pts[keep], vel[keep]
+    if len(pts) < 2:
+        return pts, vel
+    if np.any(vel <= 0):
+        raise ValueError("The velocities must be positive.")
+
+    # time at each point: a move from v0 to v1 over a length L takes
+    # L / (v1 - v0) * ln(v1 / v0), L / v0 at a constant velocity
+    segments = np.diff(pts, axis=0)
+    lengths = np.linalg.norm(segments, axis=1)
+    v0, v1 = vel[:-1], vel[1:]
+    ratio = (v1 - v0) / lengths  # velocity gained per mm
+    constant = np.abs(v1 - v0) <= 1e-9 * v0
+    durations = np.where(constant, lengths / v0, np.log(v1 / v0) / np.where(constant, 1, ratio))
+    times = np.concatenate(([0.0], np.cumsum(durations)))
+    samples = np.arange(0.0, times[-1], interval)
+
+    if corner_angle is not None:
+        unit = segments / lengths[:, None]
+        cos = np.einsum("ij,ij->i", unit[:-1], unit[1:])
+        corners = times[1:-1][cos < np.cos(np.radians(corner_angle))]
+        if len(corners):
+            # no extra short moves next to the corners
+            near = _near(samples, corners, interval / 2)
+            samples = np.union1d(samples[~near], corners)
+    if times[-1] - samples[-1] > interval * 1e-6:
+        samples = np.append(samples, times[-1])
+
+    # distance travelled on the move of each sample, inverting the time of the move
+    index = np.clip(np.searchsorted(times, samples, side="right") - 1, 0, len(lengths) - 1)
+    dt = samples - times[index]
+    k = ratio[index]
+    with np.errstate(over="ignore", invalid="ignore"):
+        distance = np.where(constant[index], v0[index] * dt,
+                            v0[index] * np.expm1(k * dt) / np.where(constant[index], 1, k))
+    distance = np.clip(distance, 0, lengths[index])
+    new_pts = pts[index] + segments[index] * (distance / lengths[index])[:, None]
+    new_vel = v0[index] + k * distance
+    return new_pts, new_vel
+
+
+def _near(samples, corners, distance):
+    """samples closer than distance to a corner (both sorted)"""
+    pos = np.searchsorted(corners, samples)
+    before = np.abs(samples - corners[np.maximum(pos - 1, 0)])
+    after = np.abs(corners[np.minimum(pos, len(corners) - 1)] - samples)
+    return np.minimum(before, after) < distance
+
+
+# motion instructions, the blocks counted by ModuleWriter
+MOTIONS = ("LIN ", "PTP ", "CIRC ", "SLIN ", "SPL ", "SCIRC ", "SPTP ")
+
+
+class ModuleWriter:
+    """
+    Writes KRL lines into a chain of sub-programs (.src / .dat modules) on disk.
+    A new module starts before the motion block that would exceed the budget,
+    never inside a SPLINE ... ENDSPLINE block.
+    Behaves like the code list (append / extend) so it can replace it.
+    """
+
+    def __init__(self, folder, name, max_blocks=None, max_bytes=None):
+        """
+        Parameters:
+        folder (str): output folder
+        name (str): program name, modules are called name_001, name_002...
+        max_blocks (int): maximum motion blocks per module
+        max_bytes (int): maximum size of a module .src file
+        """
+        self.folder = folder
+        self.name = name
+        self.max_blocks = max_blocks
+        self.max_bytes = max_bytes
+        self.modules = []
+        self.file = None
+        self.blocks = 0
+        self.size = 0
+        self.lines = 0
+        self.spline = False
+
+    def _open(self):
+        module = f"{self.name}_{len(self.modules) + 1:03}"
+        self.modules.append(module)
+        with open(os.path.join(self.folder, module + ".dat"), "w") as dat:
+            dat.write(f"&ACCESS RVP\n&REL 1\nDEFDAT {module}\nENDDAT\n")
+        self.file = open(os.path.join(self.folder, module + ".src"), "w")
+        head = f"&ACCESS RVP\n&REL 1\nDEF {module} ( )\n"
+        self.file.write(head)
+        self.size = len(head) + len("END")
+        self.blocks = 0
+
+    def _close(self):
+        if self.file is not None:
+            self.file.write("END")
+            self.file.close()
+            self.file = None
+
+    def _full(self, size):
+        return self.blocks and (
+            (self.max_blocks and self.blocks >= self.max_blocks)
+            or (self.max_bytes and self.size + size > self.max_bytes))
+
+    def append(self, line):
+        """Adds a line, starting a new module if a motion block does not fit."""
+        data = line + "\n"
+        motion = line.startswith(MOTIONS)
+        if line.startswith("SPLINE"):
+            self.spline = True
+            start = True
+        else:
+            start = motion and not self.spline
+        if line.startswith("ENDSPLINE"):
+            self.spline = False
+        if self.file is None or (start and self._full(len(data))):
+            self._close()
+            self._open()
+        self.file.write(data)
+        self.size += len(data)
+        self.blocks += motion
+        self.lines += 1
+
+    def extend(self, lines):
+        """Adds several lines."""
+        for line in lines:
+            self.append(line)
+
+    def close(self):
+        """Ends the last module, returns the module names in order."""
+        self._close()
+        return self.modules
+
+    def __len__(self):
+        return self.lines
+
+
 class KukaKRL:
 
     def __init__(self, name):
         self.name = name
         self.base = None
         self.tool = None
+        self.velocity = None
         self.code = []
+        self.master = None
 
     def open_fold(self, comment: str):
         """Opens a fold with a comment."""
@@ -32,6 +219,7 @@ class KukaKRL:
             print(
                 f"Speed is defined in m/s. Provided speed is {velocity} m/s. Please check the units")
         self.code.append(f"$VEL.CP={velocity}")
+        self.velocity = velocity
     
     def set_tool(self, number):
         """Defines the tool number. Accepts an integer between 1-16."""
@@ -54,75 +242,75 @@ class KukaKRL:
             raise Exception(
                 'You need to define a tool and a base first.')
 
-            if len(startposition) == 6 and all(isinstance(i, (int, float)) for i in startposition):
-                A1, A2, A3, A4, A5, A6 = startposition
-            else:
-                raise Exception(
-                    "Start position should be a tuple with angles for each robot axis")
-            # An Array that will contain all of the commands
-            self.code = []
-            base = self.base
-            tool = self.tool
-
-            # header from template
-            self.code.append("&ACCESS RVP")
-            self.code.append("&REL 1")
-            self.code.append("&PARAM TEMPLATE = C:\KRC\Roboter\Template\\vorgabe")
-            self.code.append("&PARAM EDITMASK = *")
-
-            # add some initial setup stuff
-            self.code.append("DEF "+str(self.name)+" ( )")
-            self.code.append(";FOLD INI")
-            self.code.append(";FOLD BASISTECH INI")
-            self.code.append(
-                "GLOBAL INTERRUPT DECL 3 WHEN $STOPMESS==TRUE DO IR_STOPM ( )")
-
-            """
-                INTERRUPT
-
-                Description Executes one of the following actions:
-                    - Activates an interrupt.
-                    - Deactivates an interrupt.
-                    - Disables an interrupt.
-                    - Enables an interrupt.
-                Up to 16 interrupts may be active at any one time
-                
-            """
-            self.code.append("INTERRUPT ON 3")
-            self.code.append("BAS (#INITMOV,0 )")
-            self.code.append(";ENDFOLD (BASISTECH INI)")
-            self.code.append(";ENDFOLD (INI)")
-
-            self.code.append(";FOLD STARTPOSITION - BASE IS {}, TOOL IS {}, SPEED IS 100%, POSITION IS A1 {},A2 {},A3 {},A4 {},A5 {},A6 {},E1 0,E2 0,E3 0,E4 0".format(
-                base, tool, A1, A2, A3, A4, A5, A6))
-            self.code.append("$BWDSTART = FALSE")
-            self.code.append("PDAT_ACT = {VEL 100,ACC 20,APO_DIST 50}")
-            self.code.append(
-                "FDAT_ACT = {{TOOL_NO {},BASE_NO {},IPO_FRAME #BASE}}".format(tool, base))
-            self.code.append("BAS (#PTP_PARAMS,100)")
-            self.code.append("PTP  {{A1 {},A2 {},A3 {},A4 {},A5 {},A6 {},E1 0,E2 0,E3 0,E4 0}}".format(
-                A1, A2, A3, A4, A5, A6))
-            self.code.append(";ENDFOLD")
-
-            # self.code.append("$APO.CDIS = 0.5000")
-            # self.code.append("BAS (#INITMOV,0)")
-            # self.code.append("BAS (#VEL_PTP,20)")
-            # self.code.append("BAS (#ACC_PTP,20)")
-            # self.code.append("")
-
-            """
-                Advance run
-                The advance run is the maximum number of motion blocks that the robot controller calculates and plans in advance during program execution. The actual
-                number is dependent on the capacity of the computer.
-                The advance run refers to the current position of the block pointer. It is set via
-                the system variable $ADVANCE:
-                    - Default value: 3
-                    - Maximum value: 5
-                The advance run is required, for example, in order to be able to calculate approximate positioning motions. If $ADVANCE = 0 is set, approximate positioning is not possible.
-                Certain statements trigger an advance run stop. These include statements
-                that influence the periphery, e.g. OUT statements
-            """
-            self.code.append("$ADVANCE=3")
+        if len(startposition) == 6 and all(isinstance(i, (int, float)) for i in startposition):
+            A1, A2, A3, A4, A5, A6 = startposition
+        else:
+            raise Exception(
+                "Start position should be a tuple with angles for each robot axis")
+        # An Array that will contain all of the commands
+        self.code = []
+        base = self.base
+        tool = self.tool
+
+        # header from template
+        self.code.append("&ACCESS RVP")
+        self.code.append("&REL 1")
+        self.code.append("&PARAM TEMPLATE = C:\KRC\Roboter\Template\\vorgabe")
+        self.code.append("&PARAM EDITMASK = *")
+
+        # add some initial setup stuff
+        self.code.append("DEF "+str(self.name)+" ( )")
+        self.code.append(";FOLD INI")
+        self.code.append(";FOLD BASISTECH INI")
+        self.code.append(
+            "GLOBAL INTERRUPT DECL 3 WHEN $STOPMESS==TRUE DO IR_STOPM ( )")
+
+        """
+            INTERRUPT
+
+            Description Executes one of the following actions:
+                - Activates an interrupt.
+                - Deactivates an interrupt.
+                - Disables an interrupt.
+                - Enables an interrupt.
+            Up to 16 interrupts may be active at any one time
+            
+        """
+        self.code.append("INTERRUPT ON 3")
+        self.code.append("BAS (#INITMOV,0 )")
+        self.code.append(";ENDFOLD (BASISTECH INI)")
+        self.code.append(";ENDFOLD (INI)")
+
+        self.code.append(";FOLD STARTPOSITION - BASE IS {}, TOOL IS {}, SPEED IS 100%, POSITION IS A1 {},A2 {},A3 {},A4 {},A5 {},A6 {},E1 0,E2 0,E3 0,E4 0".format(
+            base, tool, A1, A2, A3, A4, A5, A6))
+        self.code.append("$BWDSTART = FALSE")
+        self.code.append("PDAT_ACT = {VEL 100,ACC 20,APO_DIST 50}")
+        self.code.append(
+            "FDAT_ACT = {{TOOL_NO {},BASE_NO {},IPO_FRAME #BASE}}".format(tool, base))
+        self.code.append("BAS (#PTP_PARAMS,100)")
+        self.code.append("PTP  {{A1 {},A2 {},A3 {},A4 {},A5 {},A6 {},E1 0,E2 0,E3 0,E4 0}}".format(
+            A1, A2, A3, A4, A5, A6))
+        self.code.append(";ENDFOLD")
+
+        # self.code.append("$APO.CDIS = 0.5000")
+        # self.code.append("BAS (#INITMOV,0)")
+        # self.code.append("BAS (#VEL_PTP,20)")
+        # self.code.append("BAS (#ACC_PTP,20)")
+        # self.code.append("")
+
+        """
+            Advance run
+            The advance run is the maximum number of motion blocks that the robot controller calculates and plans in advance during program execution. The actual
+            number is dependent on the capacity of the computer.
+            The advance run refers to the current position of the block pointer. It is set via
+            the system variable $ADVANCE:
+                - Default value: 3
+                - Maximum value: 5
+            The advance run is required, for example, in order to be able to calculate approximate positioning motions. If $ADVANCE = 0 is set, approximate positioning is not possible.
+            Certain statements trigger an advance run stop. These include statements
+            that influence the periphery, e.g. OUT statements
+        """
+        self.code.append("$ADVANCE=3")
 
     def set_output(self, output_number: int, state: bool):
         """Set the state of a specified output."""
@@ -138,7 +326,7 @@ class KukaKRL:
             raise ValueError("Position must be a tuple with 6 values (X, Y, Z, A, B, C).")
         a1, a2, a3, a4, a5, a6 = position
         self.code.append(
-            f"PTP {{A1 {a1}, A2 {a2}, A3 {a3}, A4 {a4}, A5 {a5}, A6 {a6}, E1 {e1}, E2 {e2}, E3 0, E4 0, E5 0, E6 0}}"
+            f"PTP {{A1 {a1}, A2 {a2}, A3 {a3}, A4 {a4}, A5 {a5}, A6 {a6}, E1 0, E2 0, E3 0, E4 0, E5 0, E6 0}}"
         )
 
     def lin(self, position: tuple):
@@ -150,21 +338,138 @@ class KukaKRL:
             f"LIN {{X {x:.1f}, Y {y:.1f}, Z {z:.1f}, A {a:.2f}, B {b:.2f}, C {c:.2f}, E1 {0}, E2 {0}}} C_DIS"
         )
 
-    def write_file(self, filename):
+    def lin_block(self, poses, velocities=None):
+        """
+        Linear motions through an array of poses, the batch version of lin().
+        Writes $VEL.CP only where the velocity changes.
 
-        if (self.TOOL_IS_DEFINED == False):
-            Exception('You must define a tool')
-            return
-        if (self.BASE_IS_DEFINED == False):
-            Exception('You must define a base')
+        Parameters:
+        poses (array): N x 6 poses (X, Y, Z, A, B, C)
+        velocities (array): N velocities in m/s (optional), the velocity of each move
+        """
+        poses = np.asarray(poses, dtype=float).reshape(-1, 6)
+        if velocities is None:
+            self.code.extend(format_blocks(LIN_FORMAT, poses))
             return
+        for start, end in self._velocity_runs(velocities, len(poses)):
+            self.code.extend(format_blocks(LIN_FORMAT, poses[start:end]))
+
+    def spline_block(self, poses, velocities=None, max_points=100, segment="SPL"):
+        """
+        Spline motions through an array of poses: consecutive points are grouped in
+        SPLINE ... ENDSPLINE blocks of up to max_points segments, approximated into each
+        other (C_SPL). The velocity is set on the segments where it changes
+        (WITH $VEL.CP=...), so velocity changes do not break the blocks.
+
+        Parameters:
+        poses (array): N x 6 poses (X, Y, Z, A, B, C)
+        velocities (array): N velocities in m/s (optional)
+        max_points (int): maximum segments per spline block
+        segment (str): "SPL" (curved through the points) or "SLIN" (straight segments)
+        """
+        if segment not in ("SPL", "SLIN"):
+            raise ValueError("The spline segment must be SPL or SLIN.")
+        if max_points < 1:
+            raise ValueError("A spline block needs at least one point.")
+        poses = np.asarray(poses, dtype=float).reshape(-1, 6)
+        lines = format_blocks(segment + SEGMENT_FORMAT, poses)
+        if velocities is not None:
+            velocities = self._velocities(velocities, len(poses))
+            previous = [self.velocity] + velocities[:-1]
+            for i, (velocity, before) in enumerate(zip(velocities, previous)):
+                if velocity != before:
+                    lines[i] += f" WITH $VEL.CP={velocity}"
+            if velocities:
+                self.velocity = velocities[-1]
+        for i in range(0, len(lines), max_points):
+            self.code.append("SPLINE")
+            self.code.extend(lines[i:i + max_points])
+            self.code.append("ENDSPLINE C_SPL")
+
+    def _velocities(self, velocities, n):
+        """
+        Velocities in m/s as a list, rounded to mm/s as krl_toolpath writes them
+        """
+        velocities = [round(v, 3) for v in np.asarray(velocities, dtype=float).tolist()]
+        if len(velocities) != n:
+            raise ValueError("There must be one velocity per pose.")
+        if velocities and max(velocities) > 1:
+            print(
+                f"Speed is defined in m/s. Provided speed is {max(velocities)} m/s. Please check the units")
+        return velocities
+
+    def _velocity_runs(self, velocities, n):
+        """
+        Yields (start, end) of the runs of poses with the same velocity,
+        writing $VEL.CP before each run that changes it
+        """
+        velocities = np.asarray(self._velocities(velocities, n))
+        changes = np.flatnonzero(velocities[1:] != velocities[:-1]) + 1
+        starts = np.concatenate(([0], changes)) if n else changes
+        ends = np.append(starts[1:], n)
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            velocity = velocities[start].item()
+            if velocity != self.velocity:
+                self.code.append(f"$VEL.CP={velocity}")
+                self.velocity = velocity
+            yield start, end
+
+    def ptp_block(self, positions):
+        """
+        Point-to-point motions through an array of axis positions, the batch version of ptp().
+
+        Parameters:
+        positions (array): N x 6 axis angles (A1 to A6)
+        """
+        self.code.extend(format_blocks(PTP_FORMAT, positions))
+
+    def open_split(self, folder, max_blocks=20000, max_bytes=None):
+        """
+        Streams the following lines into chained sub-programs in a folder instead of
+        self.code (see ModuleWriter). The lines written so far (the header) stay in
+        the master program, which calls the modules by name in order. Finish with close_split().
+
+        Parameters:
+        folder (str): output folder
+        max_blocks (int): maximum motion blocks per sub-program
+        max_bytes (int): maximum size in bytes of a sub-program
+        """
+        if self.master is not None:
+            raise Exception("The program is already being split.")
+        self.master = self.code
+        self.code = ModuleWriter(folder, self.name, max_blocks, max_bytes)
+
+    def close_split(self):
+        """
+        Ends the last sub-program and writes the master program to the folder.
+
+        Returns:
+        str: the path of the master program
+        """
+        if self.master is None:
+            raise Exception("Run open_split() first.")
+        writer = self.code
+        modules = writer.close()
+        # KRL calls a sub-program by its name
+        self.code = self.master + [f"{module}( )" for module in modules]
+        self.master = None
+        filename = os.path.join(writer.folder, self.name + ".src")
+        self.write_file(filename)
+        return filename
+
+    def write_file(self, filename):
+
+        if not self.tool:
+            raise Exception('You must define a tool')
+        if not self.base:
+            raise Exception('You must define a base')
 
         # Since we are done adding lines to the program, we will END it
         self.code.append("END")
 
         # Write each line of the KUKA src program to the specified file
-        fileOut = open(filename, "w")
-        for line in range(len(self.code)-1):
-            fileOut.write(self.code[line] + "\n")
+        with open(filename, "w") as fileOut:
+            for line in range(len(self.code)-1):
+                fileOut.write(self.code[line] + "\n")
 
-        fileOut.write(self.code[-1])
+            fileOut.write(self.code[-1])
@@ -1,6 +1,10 @@
-import rhinoscriptsyntax as rs
+try:
+    import rhinoscriptsyntax as rs
+except ImportError:  # running outside Rhino, see backendlib
+    rs = None
 from curvelib import centercrv
 import math
+import numpy as np
 
 
 def selfclosestpt2(pts, i, diam):
@@ -152,6 +156,70 @@ def gcodeline(g, pt=None, x=None, y=None, z=None, f=None, e=None, v=None):
     gline =  g + x + y + z + v + e + f 
     return(gline)
 
+def _words(letter, values, fmt, keep):
+    """formats the kept values of a column as gcode words, empty strings elsewhere"""
+    words = np.full(len(values), "", dtype=object)
+    fmt = " " + letter + fmt
+    words[keep] = [fmt % v for v in values[keep].tolist()]
+    return words
+
+
+def gcodeblock(g, pts, f=None, e=None, decimals=1, modal=True, state=None):
+    """
+    Creates a block of gcode lines from arrays, the batch version of gcodeline
+    With modal=True the X, Y, Z and F words are only written when their value changes
+    from the previous line, which is valid modal gcode and makes the files smaller
+
+    Arguments
+        g: G number of the moves (0 or 1)
+        pts: N x 3 array or list of points, X Y Z coordinates
+        f: feedrate, a single value or a list with one per point
+        e: list with the absolute extrusion of every point (optional)
+        decimals: decimals written for X, Y, Z and E
+        modal: skip the words that did not change
+        state: dict with the last written values, to continue a previous block.
+            It is updated with the values at the end of this block
+    Returns
+        str with one line per point (without the final line break)
+    """
+    pts = np.asarray([(pt[0], pt[1], pt[2]) for pt in pts] if not isinstance(pts, np.ndarray) else pts,
+                     dtype=float).reshape(-1, 3)
+    n = len(pts)
+    if not n:
+        return ""
+    fmt = "%." + str(int(decimals)) + "f"
+    columns = {"X": np.round(pts[:, 0], decimals),
+               "Y": np.round(pts[:, 1], decimals),
+               "Z": np.round(pts[:, 2], decimals)}
+    if f is not None:
+        columns["F"] = np.broadcast_to(np.asarray(f, dtype=float), (n,)).astype(np.int64)
+    state = {} if state is None else state
+
+    words = {}
+    for letter, values in columns.items():
+        keep = np.ones(n, dtype=bool)
+        if modal:
+            keep[1:] = values[1:] != values[:-1]
+            keep[0] = state.get(letter) != values[0]
+        if letter == "F":
+            keep &= values != 0  # as in gcodeline, F0 is not written
+            words[letter] = _words(letter, values, "%d", keep)
+        else:
+            words[letter] = _words(letter, values, fmt, keep)
+        state[letter] = values[-1].item()
+
+    lines = np.full(n, "G{}".format(int(g)), dtype=object)
+    lines = lines + words["X"] + words["Y"] + words["Z"]
+    if e is not None:
+        lines = lines + _words("E", np.asarray(e, dtype=float), fmt, np.ones(n, dtype=bool))
+    if "F" in words:
+        lines = lines + words["F"]
+    if modal:
+        # a move without any word does nothing
+        lines = lines[lines != "G{}".format(int(g))]
+    return "\n".join(lines.tolist())
+
+
 def caluclate_flow(nozzle, layerheight, filament):
     narea = (((nozzle / 2) ** 2) * math.pi) # nozzle area
     filarea = (((filament / 2) ** 2) * math.pi) # filament area
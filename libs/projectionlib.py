@@ -0,0 +1,220 @@
+"""Displacement and speeds of image projection
+
+Turns the lightness sampled at every toolpath point (0 black to 1 white, see
+imagelib) into displaced points, print speeds and the speed remaps of the
+robot and the Ultimaker, on whole arrays at once:
+
+    import projectionlib as pl
+    result = pl.displace(pts, normals, sizes, waveform_shape="sine", period=3)
+    pts, speeds = result["points"], result["speeds"]
+
+In porous mode the displacement follows a waveform along the point indices
+(a zigzag of the wall), scaled by the image.
+
+project() finds the closest surface, normal and image value of every point,
+split in chunks over a process pool for large point sets:
+
+    result = pl.project(pts, grids, images, domains)
+    sizes, normals = result["sizes"], result["normals"]
+"""
+
+__author__ = "jose hernandez vargas"
+__version__ = "2024-09-02"
+
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from geometrylib import remap
+from imagelib import ImageSampler
+from spatiallib import as_points
+from srflib import closest_surfaces
+
+WAVEFORMS = ("sine", "square", "triangle", "sawtooth")
+
+# speed ranges mapped to the robot ($VEL.CP factor) and the Ultimaker (flow factor)
+ROBOT_REMAP = (125, 250, 10, 5)
+ULTIMAKER_REMAP = (50, 250, 0.5, 1.5)
+
+# points per chunk of the process pool
+CHUNK_SIZE = 50000
+
+# state of a pool process, set once by _init_worker
+_worker = {}
+
+
+def waveform(index, period, phase=0, shape="sine"):
+    """
+    Periodic wave along the toolpath, from -1 to 1
+
+    Arguments
+        index: array of point indices
+        period: points per period
+        phase: offset as a fraction of the period
+        shape: "sine", "square", "triangle" or "sawtooth", all 0 and rising at
+            index 0 with no phase (square starts at 1)
+    Returns
+        array of values from -1 to 1
+    """
+    x = np.asarray(index, dtype=float) / period + phase
+    if shape == "sine":
+        return np.sin(2 * np.pi * x)
+    if shape == "square":
+        return np.where(x % 1 < 0.5, 1.0, -1.0)
+    if shape == "triangle":
+        return 1 - 4 * np.abs((x + 0.25) % 1 - 0.5)
+    if shape == "sawtooth":
+        return 2 * ((x + 0.5) % 1) - 1
+    raise ValueError(f"Unknown waveform '{shape}', use one of {', '.join(WAVEFORMS)}")
+
+
+def displace(pts, normals, sizes, speed_range=(50, 250), displacement=(0, 20),
+             waveform_shape=None, period=3, phase=0, index=None):
+    """
+    Displaced points and speeds of an image projection
+
+    Arguments
+        pts: N x 3 points
+        normals: N x 3 unit normals of the surface at the points
+        sizes: N image values from 0 (black) to 1 (white)
+        speed_range: speeds of black and white
+        displacement: displacements of white and black (the thicker black lines
+            are displaced the most)
+        waveform_shape: None, or the waveform of porous mode (see WAVEFORMS)
+        period, phase: of the waveform, in points and fractions of a period
+        index: N indices of the points along the toolpath for the waveform,
+            by default 0 to N - 1
+    Returns
+        dict with
+            points: N x 3 displaced points
+            vectors: N x 3 displacement vectors
+            speeds: N speeds
+            robot: N robot velocity factors (c output of img_projection)
+            ultimaker: N Ultimaker flow factors (d output of img_projection)
+    """
+    pts = np.asarray(pts, dtype=float).reshape(-1, 3)
+    normals = np.asarray(normals, dtype=float).reshape(-1, 3)
+    sizes = np.asarray(sizes, dtype=float)
+    speeds = remap(0, 1, speed_range[0], speed_range[1], sizes)
+
+    if waveform_shape:
+        # porous mode overrides the compensation with a zigzag scaled by the image
+        if index is None:
+            index = np.arange(len(pts))
+        sizes = sizes * waveform(index, period, phase, waveform_shape)
+    distance = remap(1, 0, displacement[0], displacement[1], sizes)
+    vectors = normals * distance[:, None]
+
+    return {
+        "points": pts + vectors,
+        "vectors": vectors,
+        "speeds": speeds,
+        "robot": remap(*ROBOT_REMAP, speeds),
+        "ultimaker": remap(*ULTIMAKER_REMAP, speeds),
+    }
+
+
+def _project(pts, grids, images, domains, footprint):
+    """closest surface, parameters, normals and image values of a chunk of points"""
+    index, uv, _ = closest_surfaces(pts, grids)
+    normals = np.zeros((len(pts), 3))
+    sizes = np.zeros(len(pts))
+    for k, grid in enumerate(grids):
+        idx = np.flatnonzero(index == k)
+        if not len(idx):
+            continue
+        params = uv[idx]
+        (u0, u1), (v0, v1) = domains[k]
+        # the surface domain is mapped to the image
+        u = (params[:, 0] - u0) / (u1 - u0)
+        v = (params[:, 1] - v0) / (v1 - v0)
+        if footprint:
+            size = grid.uv_size(params, footprint)
+            sizes[idx] = images[k].sample(u, v, footprint=(size[:, 0] / (u1 - u0), size[:, 1] / (v1 - v0)))
+        else:
+            sizes[idx] = images[k].sample(u, v, "nearest")
+        normals[idx] = grid.normal(params)
+    return index, uv, normals, sizes
+
+
+def _init_worker(grids, images, domains, footprint):
+    """attaches a pool process to the images in shared memory"""
+    memory = [shared_memory.SharedMemory(name=name) for name, _ in images]
+    samplers = [ImageSampler(np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+                for shm, (_, shape) in zip(memory, images)]
+    _worker.update(grids=grids, images=samplers, domains=domains, footprint=footprint, memory=memory)
+
+
+def _project_chunk(pts):
+    """_project() in a pool process, with its duration"""
+    start = time.time()
+    result = _project(pts, _worker["grids"], _worker["images"], _worker["domains"], _worker["footprint"])
+    return result + (time.time() - start,)
+
+
+def project(pts, grids, images, domains, footprint=0, workers=None, chunk_size=CHUNK_SIZE, python=None):
+    """
+    Closest surface, normal and image value of every point. The points are split
+    in chunks processed by a pool of processes that share the decoded images,
+    or in this process if there is a single worker or chunk
+
+    Arguments
+        pts: N x 3 points
+        grids: SurfaceGrid of every surface
+        images: ImageSampler of every surface
+        domains: ((u0, u1), (v0, v1)) of every surface, mapped to the image
+        footprint: nozzle width on the surface to average the image over, 0 samples
+            the nearest pixel
+        workers: number of processes, by default one per core
+        chunk_size: points per chunk
+        python: python executable of the pool processes. They are spawned from
+            sys.executable by default, which inside Rhino is Rhino itself, so run
+            a single worker there or pass a real python
+    Returns
+        dict with
+            index: N indices of the closest surface
+            uv: N x 2 parameters on that surface
+            normals: N x 3 surface normals
+            sizes: N image values from 0 (black) to 1 (white)
+            timings: seconds of every chunk
+    """
+    pts = as_points(pts)
+    chunks = [pts[s:s + chunk_size] for s in range(0, len(pts), chunk_size)] or [pts]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+
+    if workers <= 1:
+        results = []
+        for chunk in chunks:
+            start = time.time()
+            results.append(_project(chunk, grids, images, domains, footprint) + (time.time() - start,))
+    else:
+        memory = []
+        try:
+            shared = []
+            for image in images:
+                shm = shared_memory.SharedMemory(create=True, size=max(image.values.nbytes, 1))
+                memory.append(shm)
+                np.ndarray(image.values.shape, dtype=np.float32, buffer=shm.buf)[:] = image.values
+                shared.append((shm.name, image.values.shape))
+            context = multiprocessing.get_context("spawn")
+            if python:
+                context.set_executable(python)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                     initargs=(grids, shared, domains, footprint)) as pool:
+                # map returns the chunks in order
+                results = list(pool.map(_project_chunk, chunks))
+        finally:
+            for shm in memory:
+                shm.close()
+                shm.unlink()
+
+    index, uv, normals, sizes, timings = zip(*results)
+    return {
+        "index": np.concatenate(index),
+        "uv": np.concatenate(uv),
+        "normals": np.concatenate(normals),
+        "sizes": np.concatenate(sizes),
+        "timings": list(timings),
+    }
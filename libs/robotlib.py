@@ -0,0 +1,256 @@
+"""Inverse kinematics and reachability check for 6 axis KUKA robots
+
+Batch analytic inverse kinematics for the usual KUKA geometry (shoulder offset,
+elbow offset and spherical wrist), with the KUKA axis conventions: at
+A1..A6 = 0, -90, 90, 0, 0, 0 the upper arm is vertical, the forearm points
+forward and the flange frame has A, B, C = 0, 90, 0.
+
+The geometry, axis limits and frames come from the "kinematics" entry of the
+machine settings (see machine_settings/kuka.json):
+    a1, d1: shoulder (A2) offset from the A1 axis and height above the robot root
+    a2: upper arm length (A2 to A3)
+    a3: offset of the forearm axis from A3, perpendicular to the forearm
+    d4: forearm length (A3 to the wrist centre)
+    d6: wrist centre to flange
+    limits: [min, max] in degrees for A1 to A6
+    base: X, Y, Z, A, B, C of the base (the frame of the poses) in the robot root
+    tool: X, Y, Z, A, B, C of the TCP in the flange
+Works without Rhino on N x 6 pose arrays (X, Y, Z, A, B, C).
+"""
+
+__author__ = "jose hernandez vargas"
+__version__ = "2024-09-02"
+
+import json
+import numpy as np
+from gcodelib import machine_file_path
+
+# poses closer than this (degrees of A5, mm of the wrist centre to A1) are singular
+WRIST_SINGULARITY = 2.0
+SHOULDER_SINGULARITY = 10.0
+
+
+def load_kinematics(machine_file="kuka"):
+    """
+    Reads the robot geometry from a machine settings file
+
+    Arguments
+        machine_file: name of the file in machine_settings (without extension)
+    Returns
+        dict with the kinematics (see module docstring)
+    """
+    with open(machine_file_path(machine_file)) as file:
+        machine = json.load(file)
+    if "kinematics" not in machine:
+        raise ValueError(f"No kinematics in the machine settings '{machine_file}'")
+    return machine["kinematics"]
+
+
+def _rz(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    o, z = np.ones_like(angle), np.zeros_like(angle)
+    return np.stack([np.stack([c, -s, z], -1), np.stack([s, c, z], -1), np.stack([z, z, o], -1)], -2)
+
+
+def _ry(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    o, z = np.ones_like(angle), np.zeros_like(angle)
+    return np.stack([np.stack([c, z, s], -1), np.stack([z, o, z], -1), np.stack([-s, z, c], -1)], -2)
+
+
+def _rx(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    o, z = np.ones_like(angle), np.zeros_like(angle)
+    return np.stack([np.stack([o, z, z], -1), np.stack([z, c, -s], -1), np.stack([z, s, c], -1)], -2)
+
+
+def abc_matrix(abc):
+    """
+    Rotation matrices of KUKA A, B, C angles (Z, Y', X'' rotations)
+
+    Arguments
+        abc: N x 3 angles in degrees
+    Returns
+        N x 3 x 3 array
+    """
+    a, b, c = np.radians(np.asarray(abc, dtype=float).reshape(-1, 3)).T
+    return _rz(a) @ _ry(b) @ _rx(c)
+
+
+def matrix_abc(matrices):
+    """
+    KUKA A, B, C angles in degrees of N x 3 x 3 rotation matrices
+    """
+    m = np.asarray(matrices, dtype=float).reshape(-1, 3, 3)
+    a = np.arctan2(m[:, 1, 0], m[:, 0, 0])
+    b = np.arctan2(-m[:, 2, 0], np.hypot(m[:, 2, 1], m[:, 2, 2]))
+    c = np.arctan2(m[:, 2, 1], m[:, 2, 2])
+    return np.degrees(np.column_stack((a, b, c)))
+
+
+def _frame(frame):
+    """rotation and translation of an X, Y, Z, A, B, C frame"""
+    frame = np.asarray(frame, dtype=float)
+    return abc_matrix(frame[3:])[0], frame[:3]
+
+
+def _arm(kinematics, axes):
+    """rotation of the forearm frame (A1 to A3), axes in radians"""
+    return _rz(-axes[:, 0]) @ _ry(axes[:, 1] + axes[:, 2])
+
+
+def forward(axes, kinematics):
+    """
+    Tool poses of a list of axis positions, to verify the inverse kinematics
+
+    Arguments
+        axes: N x 6 axis angles in degrees
+        kinematics: robot geometry (see module docstring)
+    Returns
+        N x 6 poses X, Y, Z, A, B, C in the base frame
+    """
+    k = kinematics
+    q = np.radians(np.asarray(axes, dtype=float).reshape(-1, 6))
+    # wrist centre in the plane of the arm, then rotated by A1
+    phi2 = -q[:, 1]
+    phi3 = -q[:, 1] - q[:, 2]
+    r = k["a1"] + k["a2"] * np.cos(phi2) + k["d4"] * np.cos(phi3) - k["a3"] * np.sin(phi3)
+    s = k["d1"] + k["a2"] * np.sin(phi2) + k["d4"] * np.sin(phi3) + k["a3"] * np.cos(phi3)
+    wrist = np.column_stack((r * np.cos(-q[:, 0]), r * np.sin(-q[:, 0]), s))
+
+    flange = _arm(k, q) @ _rx(-q[:, 3]) @ _ry(q[:, 4]) @ _rx(-q[:, 5]) @ _ry(np.full(len(q), np.pi / 2))
+    flange_pos = wrist + k["d6"] * flange[:, :, 2]
+
+    # flange to tool, root to base
+    tool_r, tool_t = _frame(k.get("tool", (0, 0, 0, 0, 0, 0)))
+    base_r, base_t = _frame(k.get("base", (0, 0, 0, 0, 0, 0)))
+    tcp_r = flange @ tool_r
+    tcp_pos = flange_pos + flange @ tool_t
+    pos = (tcp_pos - base_t) @ base_r
+    rot = base_r.T @ tcp_r
+    return np.column_stack((pos, matrix_abc(rot)))
+
+
+def _inverse(poses, kinematics):
+    """inverse() that also returns the wrist centres in the robot root"""
+    k = kinematics
+    poses = np.asarray(poses, dtype=float).reshape(-1, 6)
+    n = len(poses)
+
+    # tool pose in the robot root, then the flange
+    tool_r, tool_t = _frame(k.get("tool", (0, 0, 0, 0, 0, 0)))
+    base_r, base_t = _frame(k.get("base", (0, 0, 0, 0, 0, 0)))
+    tcp_r = base_r @ abc_matrix(poses[:, 3:])
+    tcp_pos = poses[:, :3] @ base_r.T + base_t
+    flange = tcp_r @ tool_r.T
+    flange_pos = tcp_pos - flange @ tool_t
+    wrist = flange_pos - k["d6"] * flange[:, :, 2]
+
+    # A1 to A3 in the plane of the arm
+    a1 = -np.arctan2(wrist[:, 1], wrist[:, 0])
+    r = np.hypot(wrist[:, 0], wrist[:, 1]) - k["a1"]
+    s = wrist[:, 2] - k["d1"]
+    dist = np.hypot(r, s)
+    forearm = np.hypot(k["d4"], k["a3"])
+    cos_shoulder = (k["a2"] ** 2 + dist ** 2 - forearm ** 2) / (2 * k["a2"] * np.maximum(dist, 1e-9))
+    reachable = np.abs(cos_shoulder) <= 1
+    phi2 = np.arctan2(s, r) + np.arccos(np.clip(cos_shoulder, -1, 1))
+    psi = np.arctan2(s - k["a2"] * np.sin(phi2), r - k["a2"] * np.cos(phi2))
+    phi3 = psi - np.arctan2(k["a3"], k["d4"])
+    a2 = -phi2
+    a3 = phi2 - phi3
+
+    # wrist: Rx(-A4) Ry(A5) Rx(-A6) = arm^T flange Ry(90)^T
+    q = np.column_stack((a1, a2, a3))
+    m = np.swapaxes(_arm(k, q), 1, 2) @ flange @ _ry(np.full(n, -np.pi / 2))
+    a5 = np.arccos(np.clip(m[:, 0, 0], -1, 1))
+    a4 = -np.arctan2(m[:, 1, 0], -m[:, 2, 0])
+    a6 = -np.arctan2(m[:, 0, 1], m[:, 0, 2])
+    # the other wrist solution: negative A5, A4 and A6 half a turn away
+    flip = np.abs(a4) > np.pi / 2
+    a5 = np.where(flip, -a5, a5)
+    a4 = np.where(flip, a4 - np.sign(a4) * np.pi, a4)
+    a6 = np.where(flip, a6 - np.sign(a6) * np.pi, a6)
+
+    axes = np.degrees(np.column_stack((a1, a2, a3, a4, a5, a6)))
+    axes = (axes + 180) % 360 - 180
+    # A4 and A6 turn continuously along the path
+    if n > 1:
+        axes[:, 3] = np.degrees(np.unwrap(np.radians(axes[:, 3])))
+        axes[:, 5] = np.degrees(np.unwrap(np.radians(axes[:, 5])))
+    axes[~reachable] = np.nan
+    return axes, reachable, wrist
+
+
+def inverse(poses, kinematics):
+    """
+    Axis positions for a list of tool poses, front (A1 towards the pose), elbow up.
+    The wrist (sign of A5) is chosen per pose for the smallest A4, then A4 and A6
+    are unwrapped along the path, as the robot would turn them.
+
+    Arguments
+        poses: N x 6 poses X, Y, Z, A, B, C in the base frame
+        kinematics: robot geometry (see module docstring)
+    Returns
+        (N x 6 axis angles in degrees, N reachable flags); the axes of unreachable
+        poses are nan
+    """
+    axes, reachable, _ = _inverse(poses, kinematics)
+    return axes, reachable
+
+
+def check_poses(poses, kinematics, start=None):
+    """
+    Pre-flight check of a robot toolpath. Pass every pose the program moves to,
+    with its orientation (see exportlib.krl_poses)
+
+    Arguments
+        poses: N x 6 poses X, Y, Z, A, B, C in the base frame
+        kinematics: robot geometry and limits (see module docstring)
+        start: A1 to A6 of the PTP start position of the program (optional),
+            checked against the axis limits
+    Returns
+        dict with
+            axes: N x 6 axis angles in degrees (nan if unreachable)
+            unreachable: indices of the poses out of reach
+            limits: indices of the poses with an axis out of its limits
+            singular: indices of the poses close to a wrist or shoulder singularity
+            start: True if the start position is out of the axis limits
+            ok: True if every pose is reachable, within the limits and not singular
+    """
+    k = kinematics
+    axes, reachable, wrist_centre = _inverse(poses, k)
+    limits = np.asarray(k["limits"], dtype=float)
+    with np.errstate(invalid="ignore"):
+        outside = np.any((axes < limits[:, 0]) | (axes > limits[:, 1]), axis=1) & reachable
+        # wrist singularity: A4 and A6 aligned, shoulder: wrist centre on the A1 axis
+        wrist = np.abs(axes[:, 4]) < WRIST_SINGULARITY
+    shoulder = np.hypot(wrist_centre[:, 0], wrist_centre[:, 1]) < SHOULDER_SINGULARITY
+    singular = (wrist | shoulder) & reachable
+    if start is not None:
+        start = np.asarray(start, dtype=float)
+        start = bool(np.any((start < limits[:, 0]) | (start > limits[:, 1])))
+
+    report = {
+        "axes": axes,
+        "unreachable": np.flatnonzero(~reachable),
+        "limits": np.flatnonzero(outside),
+        "singular": np.flatnonzero(singular),
+        "start": bool(start),
+    }
+    report["ok"] = not (len(report["unreachable"]) or len(report["limits"]) or len(report["singular"])
+                        or report["start"])
+    return report
+
+
+def report_text(report):
+    """
+    Short description of a check_poses report, one line per problem
+    """
+    lines = ["Start position out of the axis limits"] if report.get("start") else []
+    for key, text in (("unreachable", "out of reach"), ("limits", "out of the axis limits"),
+                      ("singular", "close to a singularity")):
+        idx = report[key]
+        if len(idx):
+            lines.append(f"{len(idx)} poses {text}, first at point {idx[0]}")
+    return "\n".join(lines) if lines else "All the poses are reachable"
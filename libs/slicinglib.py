@@ -0,0 +1,296 @@
+"""Layer heights for adaptive slicing
+
+The target layer height is sampled at a few heights of the part (see
+adaptive_slicing) and interpolated linearly in between. The slice heights are
+found by stepping up the part with the layer height at every slice:
+
+    import slicinglib as sc
+    layer_height = sc.HeightFunction(contour_heights, target_heights)
+    slice_heights = list(sc.layer_schedule(layer_height, brep_height))
+
+Overhangs and contours are computed on triangle meshes (vertex and face
+arrays, see mesh_arrays), without Rhino:
+
+    angles = sc.overhang_angles(vertices, faces, heights)
+    layers = sc.slice_mesh(vertices, faces, slice_heights)
+"""
+
+__author__ = "jose hernandez vargas"
+__version__ = "2024-09-02"
+
+import numpy as np
+
+# crossings closer than this fraction of the edge to a vertex are at the vertex
+SNAP = 1e-9
+
+
+class HeightFunction:
+    """
+    Piecewise linear function of the height, built once from samples.
+    Outside the samples it keeps the first or last value.
+    """
+
+    def __init__(self, heights, values):
+        """
+        Parameters:
+        heights (list): heights of the samples
+        values (list): value at every height, extra samples of either list are ignored
+        """
+        n = min(len(heights), len(values))
+        if not n:
+            raise ValueError("The height function needs at least one sample")
+        heights = np.asarray(heights[:n], dtype=float)
+        order = np.argsort(heights, kind="stable")
+        self.heights = heights[order]
+        self.values = np.asarray(values[:n], dtype=float)[order]
+
+    def __call__(self, z):
+        """
+        Value at a height or an array of heights
+
+        Parameters:
+        z (float or array): heights
+
+        Returns:
+        float or array
+        """
+        value = np.interp(z, self.heights, self.values)
+        return float(value) if np.ndim(value) == 0 else value
+
+
+def layer_schedule(layer_height, height, start=0):
+    """
+    Slice heights from start to height, every layer as thick as the layer height
+    at its bottom. The last layer is cut at the top of the part.
+
+    Arguments
+        layer_height: function of the height, e.g. a HeightFunction
+        height: top of the part
+        start: first slice height
+    Yields
+        slice heights, start and height included
+    """
+    current = start
+    yield current
+    while current < height:
+        step = layer_height(current)
+        if step <= 0:
+            raise ValueError(f"Layer height {step} at {current} must be positive")
+        current = min(current + step, height)
+        yield current
+
+
+def mesh_arrays(mesh):
+    """
+    Vertex and triangle arrays of a Rhino mesh (quads are split)
+
+    Arguments
+        mesh: Rhino.Geometry.Mesh
+    Returns
+        (V x 3 float array, F x 3 int array)
+    """
+    vertices = np.array(list(mesh.Vertices.ToFloatArray()), dtype=float).reshape(-1, 3)
+    faces = np.array(list(mesh.Faces.ToIntArray(True)), dtype=np.intp).reshape(-1, 3)
+    return vertices, faces
+
+
+def face_normals(vertices, faces):
+    """
+    Unit normals and areas of the triangles of a mesh
+
+    Arguments
+        vertices: V x 3 array
+        faces: F x 3 vertex indices
+    Returns
+        (F x 3 unit normals, F areas)
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    faces = np.asarray(faces, dtype=np.intp)
+    p0, p1, p2 = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    normals = np.cross(p1 - p0, p2 - p0)
+    length = np.linalg.norm(normals, axis=1)
+    return normals / np.where(length > 0, length, 1)[:, None], length / 2
+
+
+def overhang_angles(vertices, faces, heights, percentile=None):
+    """
+    Overhang of a mesh between slice heights, from its face normals in one pass.
+    The overhang of a face is its angle from vertical (0 for walls, 90 for flat
+    faces), both outwards and inwards as between consecutive contours. The flat
+    faces at the bottom and top of the part are ignored.
+
+    Arguments
+        vertices: V x 3 array
+        faces: F x 3 vertex indices
+        heights: sorted heights, the limits of the bins
+        percentile: None for the largest overhang of every bin, or a percentile
+            (0 - 100) of the overhangs weighted by face area, to ignore small details
+    Returns
+        array of angles in degrees, one per bin (len(heights) - 1), 0 for empty bins
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    faces = np.asarray(faces, dtype=np.intp)
+    heights = np.asarray(heights, dtype=float)
+    bins = len(heights) - 1
+    result = np.zeros(max(bins, 0))
+    if bins < 1 or not len(faces):
+        return result
+
+    normals, areas = face_normals(vertices, faces)
+    angles = np.degrees(np.arcsin(np.clip(np.abs(normals[:, 2]), 0, 1)))
+    z = vertices[faces, 2]
+    low, high = z.min(axis=1), z.max(axis=1)
+    caps = ((high <= vertices[:, 2].min()) | (low >= vertices[:, 2].max())) | (areas <= 0)
+
+    # every face counts in all the bins its height range overlaps
+    first = np.clip(np.searchsorted(heights, low, side="right") - 1, 0, bins - 1)
+    last = np.clip(np.searchsorted(heights, high, side="left") - 1, 0, bins - 1)
+    inside = ~caps & (high >= heights[0]) & (low <= heights[-1])
+    first, last = first[inside], np.maximum(last[inside], first[inside])
+    counts = last - first + 1
+    face = np.repeat(np.flatnonzero(inside), counts)
+    offsets = np.arange(len(face)) - np.repeat(np.cumsum(counts) - counts, counts)
+    bin_index = np.repeat(first, counts) + offsets
+    if not len(face):
+        return result
+
+    # faces sorted by bin, then by angle
+    order = np.lexsort((angles[face], bin_index))
+    bin_index, face = bin_index[order], face[order]
+    starts = np.flatnonzero(np.r_[True, bin_index[1:] != bin_index[:-1]])
+    ends = np.r_[starts[1:], len(face)]
+    if percentile is None:
+        result[bin_index[starts]] = angles[face[ends - 1]]
+        return result
+
+    # area weighted percentile: the first face whose cumulative area reaches it
+    weight = np.cumsum(areas[face])
+    before = np.r_[0, weight][starts]
+    target = before + (weight[ends - 1] - before) * percentile / 100
+    pick = np.minimum(np.searchsorted(weight, target, side="left"), ends - 1)
+    result[bin_index[starts]] = angles[face[np.maximum(pick, starts)]]
+    return result
+
+
+def _chain(following):
+    """
+    Orders segments into polylines from the index of the segment that follows
+    each one (-1 at the end of an open chain)
+
+    Returns
+        list of (segment indices, closed)
+    """
+    following = following.tolist()
+    has_previous = [False] * len(following)
+    for j in following:
+        if j >= 0:
+            has_previous[j] = True
+    visited = [False] * len(following)
+    chains = []
+    # open chains from their first segment, then the closed loops
+    starts = [i for i in range(len(following)) if not has_previous[i]]
+    for i in starts + list(range(len(following))):
+        if visited[i]:
+            continue
+        chain = []
+        j = i
+        while j >= 0 and not visited[j]:
+            visited[j] = True
+            chain.append(j)
+            j = following[j]
+        chains.append((chain, j == i))
+    return chains
+
+
+def slice_mesh(vertices, faces, heights):
+    """
+    Contours of a closed triangle mesh at a list of heights, without Rhino.
+    Every triangle is only intersected with the planes between its lowest and
+    highest vertex, and the segments are joined through the mesh edges they cut.
+    Outer contours run counterclockwise seen from above, holes clockwise.
+    A vertex on a plane counts as above it, so the planes at or above the top
+    of the mesh, which only touch its flat caps, give no contours, like those
+    at or below its bottom.
+
+    Arguments
+        vertices: V x 3 array
+        faces: F x 3 vertex indices, consistently oriented
+        heights: slice heights, e.g. from layer_schedule (any order)
+    Returns
+        list with the polylines of every height, each an N x 3 array; closed
+        polylines repeat their first point at the end
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    faces = np.asarray(faces, dtype=np.intp).reshape(-1, 3)
+    heights = np.asarray(heights, dtype=float)
+    layers = [[] for _ in range(len(heights))]
+    if not len(faces) or not len(heights):
+        return layers
+    order = np.argsort(heights, kind="stable")
+    sorted_heights = heights[order]
+
+    # planes crossing each triangle: a vertex below (z < h) and one above (z >= h)
+    z = vertices[faces, 2]
+    first = np.searchsorted(sorted_heights, z.min(axis=1), side="right")
+    last = np.searchsorted(sorted_heights, z.max(axis=1), side="right")
+    last = np.minimum(last, np.searchsorted(sorted_heights, vertices[:, 2].max(), side="left"))
+    counts = np.maximum(last - first, 0)
+    face = np.repeat(np.arange(len(faces)), counts)
+    plane = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    if not len(face):
+        return layers
+    # triangles by plane, so every plane is a contiguous range of segments
+    by_plane = np.argsort(plane, kind="stable")
+    face, plane = face[by_plane], plane[by_plane]
+    h = sorted_heights[plane]
+
+    # the triangle edge going down through the plane starts the segment, the edge
+    # going up ends it, so the contours turn as the triangles seen from outside
+    tri = faces[face]
+    above = z[face] >= h[:, None]
+    up = ~above & np.roll(above, -1, axis=1)
+    down = above & ~np.roll(above, -1, axis=1)
+    ends = []
+    for crossing in (down, up):
+        k = np.argmax(crossing, axis=1)
+        a = tri[np.arange(len(tri)), k]
+        b = tri[np.arange(len(tri)), (k + 1) % 3]
+        lo, hi = np.minimum(a, b), np.maximum(a, b)
+        ends.append(np.column_stack((plane, lo, hi)))
+
+    # edge keyed lookup: the segment that starts on the edge where a segment ends
+    ends = np.vstack(ends)
+    edge = ends[:, 1] * len(vertices) + ends[:, 2]
+    sort = np.lexsort((edge, ends[:, 0]))
+    new = np.r_[True, (np.diff(edge[sort]) != 0) | (np.diff(ends[sort, 0]) != 0)]
+    ids = np.empty(len(ends), dtype=np.intp)
+    ids[sort] = np.cumsum(new) - 1
+    keys = ends[sort][new]
+    start_id, end_id = ids[:len(face)], ids[len(face):]
+    starting = np.full(len(keys), -1, dtype=np.intp)
+    starting[start_id] = np.arange(len(face))
+    following = starting[end_id]
+
+    # crossing point of every cut edge, computed once from its lower index vertex
+    p0, p1 = vertices[keys[:, 1]], vertices[keys[:, 2]]
+    dz = p1[:, 2] - p0[:, 2]
+    t = (sorted_heights[keys[:, 0]] - p0[:, 2]) / np.where(dz != 0, dz, 1)
+    points = p0 + (p1 - p0) * t[:, None]
+    # planes through a vertex cut all its edges there: snap to the vertex so the
+    # crossings are the same point, not near duplicates from the rounding
+    points[t <= SNAP] = p0[t <= SNAP]
+    points[t >= 1 - SNAP] = p1[t >= 1 - SNAP]
+    points[:, 2] = sorted_heights[keys[:, 0]]
+
+    for chain, closed in _chain(following):
+        chain = np.asarray(chain)
+        ids = start_id[chain]
+        ids = np.append(ids, ids[0] if closed else end_id[chain[-1]])
+        polyline = points[ids]
+        # slices through vertices cut edges at their ends, drop the repeated points
+        keep = np.r_[True, np.any(polyline[1:] != polyline[:-1], axis=1)]
+        polyline = polyline[keep]
+        # nothing left of loops around a single vertex
+        if len(polyline) >= (4 if closed else 2):
+            layers[order[plane[chain[0]]]].append(polyline)
+    return layers
@@ -0,0 +1,256 @@
+"""Spatial indexing on plain coordinate arrays
+
+Works without Rhino: points are anything numpy can turn into an N x 3 array
+(lists of tuples, Rhino Point3d lists, arrays).
+"""
+
+__author__ = "jose hernandez vargas"
+__version__ = "2024-09-02"
+
+import numpy as np
+
+# maximum number of candidate pairs evaluated at once, keeps memory bounded
+PAIR_CHUNK = 4000000
+
+
+def as_points(pts):
+    """
+    Converts a list of points (tuples, lists or Point3d) to an N x 3 float array
+    """
+    if isinstance(pts, np.ndarray):
+        return pts.reshape(-1, 3).astype(float, copy=False)
+    return np.array([(pt[0], pt[1], pt[2]) for pt in pts], dtype=float).reshape(-1, 3)
+
+
+class PointGrid:
+    """
+    Uniform grid (spatial hash) over a point array.
+    Points are sorted by cell so each cell is a contiguous range of indices.
+    """
+
+    def __init__(self, points, cell=None):
+        """
+        Parameters:
+        points (array): N x 3 coordinates
+        cell (float): size of the grid cells. Estimated from the point density if None
+        """
+        self.points = as_points(points)
+        self.origin = self.points.min(axis=0) if len(self.points) else np.zeros(3)
+        span = self.points.max(axis=0) - self.origin if len(self.points) else np.zeros(3)
+        self.span = float(span.max())
+        if cell is None:
+            cell = self.span / max(len(self.points), 1) ** (1 / 3)
+        self.cell = max(float(cell), 1e-9)
+        self.dims = (np.floor(span / self.cell).astype(np.int64) + 1)
+
+        keys = self._keys(self._cells(self.points))
+        self.order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[self.order]
+        self.keys, self.starts = np.unique(sorted_keys, return_index=True)
+        self.ends = np.append(self.starts[1:], len(sorted_keys))
+        self.coarser = None  # grid with twice the cell size, built by closest()
+
+    def _cells(self, pts):
+        return np.floor((pts - self.origin) / self.cell).astype(np.int64)
+
+    def _keys(self, cells):
+        return (cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2]
+
+    def _ranges(self, cells):
+        """start and end (in self.order) of the points inside each cell"""
+        inside = np.all((cells >= 0) & (cells < self.dims), axis=1)
+        start = np.zeros(len(cells), dtype=np.int64)
+        end = np.zeros(len(cells), dtype=np.int64)
+        keys = self._keys(cells[inside])
+        pos = np.searchsorted(self.keys, keys)
+        pos = np.minimum(pos, len(self.keys) - 1)
+        found = self.keys[pos] == keys
+        idx = np.flatnonzero(inside)[found]
+        start[idx] = self.starts[pos[found]]
+        end[idx] = self.ends[pos[found]]
+        return start, end
+
+    def closest(self, query):
+        """
+        Exact closest point for every query point, reusing this grid.
+        The queries with nothing near them are searched again in coarser grids,
+        which are kept for the next call.
+
+        Parameters:
+        query (array): M x 3 query coordinates
+
+        Returns:
+        (array, array): distance and index of the closest point
+        """
+        query = as_points(query)
+        dist2 = np.full(len(query), np.inf)
+        index = np.full(len(query), -1, dtype=np.int64)
+        if not len(self.points) or not len(query):
+            return np.sqrt(dist2), index
+        # queries in the order of the grid cells, the lookups stay local in memory
+        order = np.argsort(self._keys(self._cells(query)), kind="stable")
+        query = query[order]
+        pending = np.arange(len(query))
+        grid = self
+        while len(pending):
+            if grid.cell >= grid.span:
+                d2, j = _brute_force(self.points, query[pending])
+                dist2[pending], index[pending] = d2, j
+                break
+            d2, j = grid.search(query[pending])
+            # anything outside the 27 cells is at least one cell size away
+            done = d2 <= grid.cell ** 2
+            dist2[pending[done]], index[pending[done]] = d2[done], j[done]
+            pending = pending[~done]
+            if len(pending):
+                if grid.coarser is None:
+                    grid.coarser = PointGrid(self.points, grid.cell * 2)
+                grid = grid.coarser
+        result = np.empty_like(dist2), np.empty_like(index)
+        result[0][order], result[1][order] = np.sqrt(dist2), index
+        return result
+
+    def search(self, query, qindex=None, window=0):
+        """
+        Closest point among the 27 cells around each query point.
+        Results farther than self.cell might not be the true closest point.
+
+        Parameters:
+        query (array): M x 3 query coordinates
+        qindex (array): index of each query in self.points, used to skip neighbours
+        window (float): candidates with abs(index - qindex) < window are ignored
+
+        Returns:
+        (array, array): squared distance and index of the closest point (inf / -1 if none)
+        """
+        query = as_points(query)
+        best = np.full(len(query), np.inf)
+        best_idx = np.full(len(query), -1, dtype=np.int64)
+        if not len(self.points) or not len(query):
+            return best, best_idx
+        # the candidates are the same for all the queries in a cell: gather the
+        # points of the 27 cells around each occupied query cell once
+        cells, inverse = np.unique(self._cells(query), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        offsets = np.array([(i, j, k) for i in (-1, 0, 1)
+                            for j in (-1, 0, 1) for k in (-1, 0, 1)])
+        start, end = self._ranges((cells[:, None, :] + offsets[None, :, :]).reshape(-1, 3))
+        lengths = end - start
+        candidates = self.order[np.repeat(start - np.cumsum(lengths) + lengths, lengths)
+                                + np.arange(lengths.sum())]
+        cell_counts = lengths.reshape(-1, 27).sum(axis=1)
+        cell_first = np.cumsum(cell_counts) - cell_counts
+
+        counts = cell_counts[inverse]
+        qs = np.flatnonzero(counts)
+        if not len(qs):
+            return best, best_idx
+        # split the queries so that each batch stays under PAIR_CHUNK pairs
+        cum = np.cumsum(counts[qs])
+        bounds = np.searchsorted(cum, np.arange(PAIR_CHUNK, cum[-1], PAIR_CHUNK))
+        for batch in np.split(qs, bounds):
+            if not len(batch):
+                continue
+            c = counts[batch]
+            q = np.repeat(batch, c)
+            first = np.cumsum(c) - c
+            j = candidates[np.arange(len(q)) - np.repeat(first, c)
+                           + np.repeat(cell_first[inverse[batch]], c)]
+            diff = self.points[j] - query[q]
+            d2 = np.einsum("ij,ij->i", diff, diff)
+            if qindex is not None and window > 0:
+                d2[np.abs(j - qindex[q]) < window] = np.inf
+            # the candidates of each query are contiguous
+            best[batch] = np.minimum.reduceat(d2, first)
+            hit = d2 == np.repeat(best[batch], c)
+            best_idx[q[hit]] = j[hit]
+        return best, best_idx
+
+
+def _brute_force(points, query, qindex=None, window=0):
+    """exact closest point by comparing against every point, for the leftovers"""
+    chunk = max(1, PAIR_CHUNK // max(len(points), 1))
+    best = np.full(len(query), np.inf)
+    best_idx = np.full(len(query), -1, dtype=np.int64)
+    index = np.arange(len(points))
+    for s in range(0, len(query), chunk):
+        d = points[None, :, :] - query[s:s + chunk, None, :]
+        d2 = np.einsum("ijk,ijk->ij", d, d)
+        if qindex is not None and window > 0:
+            d2[np.abs(index[None, :] - qindex[s:s + chunk, None]) < window] = np.inf
+        j = np.argmin(d2, axis=1)
+        best[s:s + chunk] = d2[np.arange(len(j)), j]
+        best_idx[s:s + chunk] = np.where(np.isfinite(best[s:s + chunk]), j, -1)
+    return best, best_idx
+
+
+def closest_points(points, query, cell=None, qindex=None, window=0):
+    """
+    Closest point of a point array for every query point.
+    The grid is coarsened for the queries whose closest point lies outside
+    the searched neighbourhood, so the result is always exact.
+
+    Arguments
+        points: N x 3 point array to search
+        query: M x 3 query points
+        cell: initial grid cell size (estimated if None)
+        qindex: index of each query in points (only needed with window), can be
+            halfway between two points for a window one point longer on one side
+        window: ignore candidates with abs(index - qindex) < window
+    Returns
+        (distances, indices) arrays of length M. Distance is inf and index -1
+        when every candidate is excluded
+    """
+    points = as_points(points)
+    query = as_points(query)
+    dist2 = np.full(len(query), np.inf)
+    index = np.full(len(query), -1, dtype=np.int64)
+    if not len(points) or not len(query):
+        return np.sqrt(dist2), index
+    if qindex is not None:
+        qindex = np.asarray(qindex, dtype=float)
+    span = float((np.vstack((points, query)).max(axis=0)
+                  - np.vstack((points, query)).min(axis=0)).max())
+    pending = np.arange(len(query))
+    grid = PointGrid(points, cell)
+    while len(pending):
+        sub_index = qindex[pending] if qindex is not None else None
+        if grid.cell >= span:
+            d2, j = _brute_force(points, query[pending], sub_index, window)
+            dist2[pending], index[pending] = d2, j
+            break
+        d2, j = grid.search(query[pending], sub_index, window)
+        # anything outside the 27 cells is at least one cell size away
+        done = d2 <= grid.cell ** 2
+        dist2[pending[done]], index[pending[done]] = d2[done], j[done]
+        pending = pending[~done]
+        grid = PointGrid(points, grid.cell * 2)
+    return np.sqrt(dist2), index
+
+
+def self_clearance(pts, window, cell=None):
+    """
+    Calculates for every point the distance to its closest non-consecutive point
+    i.e. the maximum printing width to avoid self collision.
+    Batch replacement for printlib.selfclosestpt2, O(n log n) instead of O(n^2),
+    with the same candidates: the points before i - window and from i + window on,
+    never the last point of the list
+
+    Arguments
+        pts: list or N x 3 array of points
+        window: neighbours to ignore before and after each point, in number of points
+            ( = mm when the curve is divided at a regular 1 mm distance ), at least 1
+        cell: grid cell size, defaults to window times the mean segment length
+    Returns
+        array of N distances (inf when there are no points outside the window)
+    """
+    pts = as_points(pts)
+    if len(pts) < 2:
+        return np.full(len(pts), np.inf)
+    if cell is None:
+        seg = np.linalg.norm(np.diff(pts, axis=0), axis=1).mean()
+        cell = max(seg * max(window, 1), 1e-6)
+    # candidates i - window to i + window - 1 are skipped: a window half a point
+    # longer, centred half a point before i
+    window = max(window, 1)
+    return closest_points(pts[:-1], pts, cell, np.arange(len(pts)) - 0.5, window + 0.5)[0]
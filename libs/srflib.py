@@ -1,15 +1,269 @@
-import rhinoscriptsyntax as rs
+try:
+    import rhinoscriptsyntax as rs
+except ImportError:  # running outside Rhino, see backendlib
+    rs = None
+import numpy as np
+from spatiallib import PointGrid, as_points
+
+# grid points between the starting points of the closest point queries
+COARSE = 4
+
 
 def closest_srf(pt, srf0, srf1):
-    """returns the surface that is closest to a certain point"""
+    """
+    returns the surface that is closest to a certain point, exactly.
+    To assign many points build a SurfaceGrid per surface once and use closest_surfaces
+    """
     param0 = rs.SurfaceClosestPoint(srf0, pt)
     param1 = rs.SurfaceClosestPoint(srf1, pt)
-    srf0_pt = rs.EvaluateSurface(srf0, param0[0] , param0[1])
-    srf1_pt = rs.EvaluateSurface(srf1, param1[0] , param1[1])
+    srf0_pt = rs.EvaluateSurface(srf0, param0[0], param0[1])
+    srf1_pt = rs.EvaluateSurface(srf1, param1[0], param1[1])
     d0 = rs.Distance(pt, srf0_pt)
     d1 = rs.Distance(pt, srf1_pt)
-    print('distance: ', d0, d1)
     if d0 >= d1:
-        return(srf1, 1)
-    else:
-        return(srf0, 0)
\ No newline at end of file
+        return (srf1, 1)
+    return (srf0, 0)
+
+
+def closest_surfaces(pts, grids, iterations=20):
+    """
+    Nearest of several surfaces for every point, with its closest point parameters.
+    Only the surfaces whose coarse grid can hold the nearest point are refined,
+    so each point costs about one closest point query.
+
+    Arguments
+        pts: N x 3 points
+        grids: list of K SurfaceGrid, built once and reused between calls
+        iterations: maximum refinement steps
+    Returns
+        (N surface indices, N x 2 UV parameters on that surface, N distances)
+    """
+    query = as_points(pts)
+    index = np.zeros(len(query), dtype=np.intp)
+    uv = np.zeros((len(query), 2))
+    distance = np.full(len(query), np.inf)
+    if not len(query):
+        return index, uv, distance
+    # distance to the bounding box of every surface, a lower bound of the distance
+    # to the surface; the surfaces are visited from the nearest on average
+    lower = np.array([grid.box_distance(query) for grid in grids]).reshape(len(grids), len(query))
+    for k in np.argsort(lower.mean(axis=1), kind="stable"):
+        grid = grids[k]
+        todo = np.flatnonzero(lower[k] < distance)
+        if not len(todo):
+            continue
+        # the nearest coarse sample is at most coarse_error further than the surface
+        coarse, nearest = grid.coarse.closest(query[todo])
+        keep = coarse - grid.coarse_error < distance[todo]
+        todo, nearest = todo[keep], nearest[keep]
+        k_uv, _, k_distance = grid._refine(query[todo], nearest, iterations)
+        closer = k_distance < distance[todo]
+        todo = todo[closer]
+        index[todo] = k
+        uv[todo] = k_uv[closer]
+        distance[todo] = k_distance[closer]
+    return index, uv, distance
+
+
+class SurfaceGrid:
+    """
+    Surface tessellated once into a grid of points tagged with their UV parameters
+    and indexed spatially, for closest point and normal queries on point arrays.
+    A query starts at the nearest point of a coarser grid and is refined on the
+    bilinear patches of the grid, so the accuracy is the deviation of the grid
+    from the surface.
+    """
+
+    def __init__(self, points, u, v):
+        """
+        Parameters:
+        points (array): nu x nv x 3 surface points
+        u (array): nu parameters of the grid rows
+        v (array): nv parameters of the grid columns
+        """
+        self.points = np.asarray(points, dtype=float)
+        self.u = np.asarray(u, dtype=float)
+        self.v = np.asarray(v, dtype=float)
+        self.nu, self.nv = self.points.shape[:2]
+        if self.nu < 2 or self.nv < 2:
+            raise ValueError("The surface grid needs at least 2 x 2 points")
+        # spatial index of every COARSE-th grid point (and the last row / column),
+        # the starting points of the closest point queries
+        ci = np.unique(np.append(np.arange(0, self.nu, COARSE), self.nu - 1))
+        cj = np.unique(np.append(np.arange(0, self.nv, COARSE), self.nv - 1))
+        ii, jj = np.meshgrid(ci, cj, indexing="ij")
+        self.coarse_ij = np.column_stack((ii.ravel(), jj.ravel()))
+        coarse = self.points[ii, jj]
+        # mean distance between neighbours along each grid direction
+        spacing = np.mean([np.linalg.norm(np.diff(coarse, axis=0), axis=2).mean(),
+                           np.linalg.norm(np.diff(coarse, axis=1), axis=2).mean()])
+        coarse = coarse.reshape(-1, 3)
+        self.coarse = PointGrid(coarse, max(spacing, 1e-6))
+        # largest distance from the surface to its nearest coarse sample: grid points,
+        # plus the longest grid edge for the points inside the patches
+        edges = max(np.linalg.norm(np.diff(self.points, axis=0), axis=2).max(),
+                    np.linalg.norm(np.diff(self.points, axis=1), axis=2).max())
+        self.coarse_error = self.coarse.closest(self.points.reshape(-1, 3))[0].max() + edges
+        # the bilinear patches are inside the bounding box of the grid points
+        self.box = np.array([self.points.min(axis=(0, 1)), self.points.max(axis=(0, 1))])
+
+        # normals from the tangents of the grid, as Rhino (dP/du x dP/dv)
+        du = np.gradient(self.points, self.u, axis=0)
+        dv = np.gradient(self.points, self.v, axis=1)
+        normals = np.cross(du, dv)
+        length = np.linalg.norm(normals, axis=2, keepdims=True)
+        self.normals = normals / np.where(length > 0, length, 1)
+        # length on the surface of a unit step of each parameter
+        self.speeds = np.stack((np.linalg.norm(du, axis=2), np.linalg.norm(dv, axis=2)), axis=-1)
+
+    @classmethod
+    def from_surface(cls, srf, nu=100, nv=100):
+        """
+        Tessellates a Rhino surface
+
+        Parameters:
+        srf: surface id or object
+        nu, nv (int): number of points in each direction
+
+        Returns:
+        SurfaceGrid
+        """
+        surface = rs.coercesurface(srf, True)
+        du, dv = surface.Domain(0), surface.Domain(1)
+        u = np.linspace(du.Min, du.Max, nu)
+        v = np.linspace(dv.Min, dv.Max, nv)
+        points = [[tuple(surface.PointAt(a, b)) for b in v.tolist()] for a in u.tolist()]
+        return cls(points, u, v)
+
+    @classmethod
+    def from_function(cls, function, udomain, vdomain, nu=100, nv=100):
+        """
+        Tessellates a parametric surface given as a function, e.g. outside Rhino
+
+        Parameters:
+        function: f(u, v) -> x, y, z, called with arrays of parameters
+        udomain, vdomain (tuple): parameter ranges
+
+        Returns:
+        SurfaceGrid
+        """
+        u = np.linspace(udomain[0], udomain[1], nu)
+        v = np.linspace(vdomain[0], vdomain[1], nv)
+        uu, vv = np.meshgrid(u, v, indexing="ij")
+        x, y, z = function(uu, vv)
+        return cls(np.stack(np.broadcast_arrays(x, y, z), axis=-1), u, v)
+
+    def _evaluate(self, a, b):
+        """
+        Point and tangents of the bilinear patches at grid coordinates a, b
+        (a from 0 to nu - 1, b from 0 to nv - 1)
+        """
+        i = np.clip(np.floor(a).astype(np.intp), 0, self.nu - 2)
+        j = np.clip(np.floor(b).astype(np.intp), 0, self.nv - 2)
+        s = (a - i)[:, None]
+        t = (b - j)[:, None]
+        p00 = self.points[i, j]
+        p10 = self.points[i + 1, j]
+        p01 = self.points[i, j + 1]
+        p11 = self.points[i + 1, j + 1]
+        da = (p10 - p00) * (1 - t) + (p11 - p01) * t
+        db = (p01 - p00) * (1 - s) + (p11 - p10) * s
+        p = p00 + (p10 - p00) * s + db * t
+        return p, da, db
+
+    def closest(self, pts, iterations=20):
+        """
+        Closest surface point of every point, the batch version of rs.SurfaceClosestPoint
+
+        Parameters:
+        pts (array): N x 3 points
+        iterations (int): maximum refinement steps
+
+        Returns:
+        (N x 2 UV parameters, N x 3 surface points, N distances)
+        """
+        query = as_points(pts)
+        # start at the nearest point of the coarse grid
+        _, nearest = self.coarse.closest(query)
+        return self._refine(query, nearest, iterations)
+
+    def _refine(self, query, nearest, iterations):
+        """closest() of query points starting at their nearest coarse grid points"""
+        a = self.coarse_ij[nearest, 0].astype(float)
+        b = self.coarse_ij[nearest, 1].astype(float)
+
+        # Gauss-Newton steps on the bilinear patches of the grid, at most one
+        # patch at a time, until the points stop moving
+        active = np.arange(len(query))
+        for _ in range(iterations):
+            if not len(active):
+                break
+            p, da, db = self._evaluate(a[active], b[active])
+            r = p - query[active]
+            aa = np.einsum("ij,ij->i", da, da)
+            ab = np.einsum("ij,ij->i", da, db)
+            bb = np.einsum("ij,ij->i", db, db)
+            ga = np.einsum("ij,ij->i", da, r)
+            gb = np.einsum("ij,ij->i", db, r)
+            det = aa * bb - ab * ab
+            det = np.where(np.abs(det) > 1e-12, det, 1e-12)
+            step_a = np.clip(-(bb * ga - ab * gb) / det, -1, 1)
+            step_b = np.clip(-(aa * gb - ab * ga) / det, -1, 1)
+            new_a = np.clip(a[active] + step_a, 0, self.nu - 1)
+            new_b = np.clip(b[active] + step_b, 0, self.nv - 1)
+            moved = (np.abs(new_a - a[active]) > 1e-7) | (np.abs(new_b - b[active]) > 1e-7)
+            a[active] = new_a
+            b[active] = new_b
+            active = active[moved]
+
+        p, _, _ = self._evaluate(a, b)
+        i = np.clip(np.floor(a).astype(np.intp), 0, self.nu - 2)
+        j = np.clip(np.floor(b).astype(np.intp), 0, self.nv - 2)
+        uv = np.column_stack((self.u[i] + (a - i) * (self.u[i + 1] - self.u[i]),
+                              self.v[j] + (b - j) * (self.v[j + 1] - self.v[j])))
+        return uv, p, np.linalg.norm(p - query, axis=1)
+
+    def box_distance(self, pts):
+        """distance of every point to the bounding box of the surface (0 inside)"""
+        query = as_points(pts)
+        outside = np.maximum(self.box[0] - query, 0) + np.maximum(query - self.box[1], 0)
+        return np.linalg.norm(outside, axis=1)
+
+    def _interpolate(self, values, uv):
+        """bilinear interpolation of nu x nv x k grid values at N x 2 UV parameters"""
+        uv = np.asarray(uv, dtype=float).reshape(-1, 2)
+        i = np.clip(np.searchsorted(self.u, uv[:, 0], side="right") - 1, 0, self.nu - 2)
+        j = np.clip(np.searchsorted(self.v, uv[:, 1], side="right") - 1, 0, self.nv - 2)
+        s = np.clip((uv[:, 0] - self.u[i]) / (self.u[i + 1] - self.u[i]), 0, 1)[:, None]
+        t = np.clip((uv[:, 1] - self.v[j]) / (self.v[j + 1] - self.v[j]), 0, 1)[:, None]
+        n = values
+        return (n[i, j] * (1 - s) * (1 - t) + n[i + 1, j] * s * (1 - t)
+                + n[i, j + 1] * (1 - s) * t + n[i + 1, j + 1] * s * t)
+
+    def normal(self, uv):
+        """
+        Unit normals at UV parameters, the batch version of rs.SurfaceNormal
+
+        Parameters:
+        uv (array): N x 2 parameters
+
+        Returns:
+        N x 3 array
+        """
+        normals = self._interpolate(self.normals, uv)
+        length = np.linalg.norm(normals, axis=1, keepdims=True)
+        return normals / np.where(length > 0, length, 1)
+
+    def uv_size(self, uv, size):
+        """
+        Parameter ranges covered by a length on the surface, e.g. the nozzle width
+
+        Parameters:
+        uv (array): N x 2 parameters
+        size (float): length on the surface
+
+        Returns:
+        N x 2 array of U and V ranges
+        """
+        speeds = self._interpolate(self.speeds, uv)
+        return size / np.maximum(speeds, 1e-12)
@@ -0,0 +1,234 @@
+"""Toolpath operations on plain coordinate arrays
+
+Works without Rhino, points are N x 3 arrays (or anything spatiallib.as_points accepts)
+"""
+
+__author__ = "jose hernandez vargas"
+__version__ = "2024-09-02"
+
+import numpy as np
+from spatiallib import as_points, self_clearance
+
+FLOW_MODELS = ("constant", "velocity", "clearance")
+
+
+def segment_lengths(pts):
+    """
+    Returns the length of the N-1 segments of a polyline given as an N x 3 array
+    """
+    pts = as_points(pts)
+    return np.linalg.norm(np.diff(pts, axis=0), axis=1)
+
+
+def extrusion(pts, materialflow, model="constant", vel=None, clearance=None,
+              nozzle=None, window=4, adhesion=None, start=0.0):
+    """
+    Calculates the absolute extrusion (E) value of every point in one pass.
+    Each segment extrudes materialflow * factor * length, where the factor
+    depends on the flow model and is taken at the end point of the segment.
+
+    Arguments
+        pts: N x 3 points of the toolpath
+        materialflow: extrusion per mm of toolpath (see printlib.caluclate_flow)
+        model: flow model
+            "constant": factor 1
+            "velocity": factor vel[i] (list of speeds / flow multipliers)
+            "clearance": factor clearance[i] / nozzle, i.e. variable flow by distance
+        vel: N velocities, required by the "velocity" model
+        clearance: N clearance distances for the "clearance" model, calculated
+            with spatiallib.self_clearance(pts, window) if None
+        nozzle: nozzle diameter, required by the "clearance" model
+        window: neighbours ignored when calculating the clearance
+        adhesion: N flags (or factors), adds materialflow * length to the
+            segments ending on flagged points, e.g. the first layer
+        start: E value of the first point
+    Returns
+        array with N absolute E values
+    """
+    pts = as_points(pts)
+    if model not in FLOW_MODELS:
+        raise ValueError(f"Unknown flow model '{model}'. Use one of {FLOW_MODELS}")
+    n = len(pts)
+    if model == "velocity":
+        if vel is None or len(vel) != n:
+            raise ValueError("The velocity flow model needs one velocity per point")
+        factor = np.asarray(vel, dtype=float)
+    elif model == "clearance":
+        if not nozzle:
+            raise ValueError("The clearance flow model needs the nozzle diameter")
+        if clearance is None:
+            clearance = self_clearance(pts, window)
+        factor = np.asarray(clearance, dtype=float) / nozzle
+        # isolated points have no clearance limit, print them at nominal flow
+        factor[~np.isfinite(factor)] = 1.0
+    else:
+        factor = np.ones(n)
+    if adhesion is not None:
+        factor = factor + np.asarray(adhesion, dtype=float)
+
+    e = np.empty(n)
+    if not n:
+        return e
+    e[0] = start
+    e[1:] = start + np.cumsum(materialflow * factor[1:] * segment_lengths(pts))
+    return e
+
+
+def decimate(pts, tolerance, attributes=(), attribute_tolerance=0.0):
+    """
+    Simplifies a toolpath with the Ramer-Douglas-Peucker algorithm.
+    Iterative (with a stack) so it works on paths with millions of points.
+    A point is only removed if it is within tolerance of the simplified path and
+    its attributes (velocity, flow...) are within attribute_tolerance of the
+    point that ends its new segment, whose values are used for the whole segment.
+    Every split scans its whole range: about O(n log n) when the farthest points
+    fall near the middle, O(n^2) in the worst case, when every split only
+    separates a point at one end (e.g. a tight spiral).
+
+    Arguments
+        pts: N x 3 points
+        tolerance: max deviation in mm from the original path
+        attributes: list of arrays with N values per point (e.g. [VEL])
+        attribute_tolerance: max difference of the attributes of the removed points
+    Returns
+        array with the indices of the kept points, use it to slice the points
+        and every attribute list so they stay aligned
+    """
+    pts = as_points(pts)
+    n = len(pts)
+    if n < 3:
+        return np.arange(n)
+    attributes = [np.asarray(a, dtype=float) for a in attributes]
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        inner = pts[i + 1:j]
+        seg = pts[j] - pts[i]
+        length2 = seg.dot(seg)
+        rel = inner - pts[i]
+        if length2 > 0:
+            t = np.clip(rel.dot(seg) / length2, 0, 1)
+            rel = rel - t[:, None] * seg
+        distance = np.sqrt(np.einsum("ij,ij->i", rel, rel))
+        k = int(np.argmax(distance))
+        if distance[k] > tolerance:
+            # Douglas-Peucker split at the farthest point
+            k += i + 1
+        elif any(np.abs(a[i + 1:j] - a[j]).max() > attribute_tolerance for a in attributes):
+            # attributes changing along a straight run, split in the middle
+            k = (i + j) // 2
+        else:
+            continue
+        keep[k] = True
+        stack.append((i, k))
+        stack.append((k, j))
+    return np.flatnonzero(keep)
+
+
+def print_time(pts, feeds, machine, layers=None):
+    """
+    Estimates the printing time with trapezoidal acceleration profiles.
+    Cornering speeds follow the junction deviation model, and the speed
+    planning passes are computed as cumulative minimums, so the whole
+    path is evaluated in a few vectorized operations.
+
+    Arguments
+        pts: N x 3 points of the toolpath
+        feeds: feedrate in mm/min, a single value or one per point (the feedrate
+            of the move that ends on that point, as in gcode)
+        machine: machine properties (see machine_settings), uses
+            acceleration (mm/s2), junction_deviation (mm), jerk (mm/s) and
+            max_feedrate (mm/s)
+        layers: layer number of every point, defaults to the Z coordinate
+    Returns
+        (total, per_layer): total time in seconds and a list with the time of
+        each layer, in the order of the layers
+    """
+    pts = as_points(pts)
+    n = len(pts)
+    if n < 2:
+        return 0.0, []
+    acc = float(machine.get("acceleration", 1000))
+    deviation = float(machine.get("junction_deviation", 0.05))
+    jerk = float(machine.get("jerk", 0))
+    vmax = float(machine.get("max_feedrate", np.inf))
+
+    vectors = np.diff(pts, axis=0)
+    lengths = np.linalg.norm(vectors, axis=1)
+    speed = np.broadcast_to(np.asarray(feeds, dtype=float), (n,))[1:] / 60
+    speed = np.minimum(speed, vmax)
+    moving = lengths > 0
+    units = np.zeros_like(vectors)
+    units[moving] = vectors[moving] / lengths[moving, None]
+
+    # max squared speed at the n nodes, limited by the corners
+    cos = np.clip(-np.einsum("ij,ij->i", units[:-1], units[1:]), -1, 1)
+    sin_half = np.sqrt((1 - cos) / 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corner = acc * deviation * sin_half / (1 - sin_half)
+    corner[sin_half > 0.999999] = np.inf  # straight line
+    corner = np.maximum(corner, np.minimum(jerk, np.minimum(speed[:-1], speed[1:])) ** 2)
+    limit = np.empty(n)
+    limit[0] = min(jerk, speed[0]) ** 2
+    limit[-1] = min(jerk, speed[-1]) ** 2
+    limit[1:-1] = np.minimum(corner, np.minimum(speed[:-1], speed[1:]) ** 2)
+
+    # deceleration (backward) and acceleration (forward) passes:
+    # v2[i] = min(limit[i], v2[i+1] + 2 a L[i]) is a cumulative minimum over offsets
+    s = np.concatenate(([0.0], np.cumsum(2 * acc * lengths)))
+    backward = np.minimum.accumulate((limit + s)[::-1])[::-1] - s
+    v2 = np.maximum(np.minimum.accumulate(backward - s) + s, 0)
+    v2 = np.minimum(v2, backward)
+
+    # time of every segment, trapezoid or triangle profile
+    vs = np.sqrt(v2[:-1])
+    ve = np.sqrt(v2[1:])
+    vc = np.maximum(speed, np.maximum(vs, ve))
+    d_acc = (vc ** 2 - v2[:-1]) / (2 * acc)
+    d_dec = (vc ** 2 - v2[1:]) / (2 * acc)
+    cruise = lengths - d_acc - d_dec
+    peak = np.sqrt(np.maximum(acc * lengths + (v2[:-1] + v2[1:]) / 2, 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        time = np.where(cruise >= 0,
+                        (vc - vs) / acc + (vc - ve) / acc + cruise / vc,
+                        (peak - vs) / acc + (peak - ve) / acc)
+    time[~moving] = 0
+
+    if layers is None:
+        layers = np.round(pts[:, 2], 3)
+    ids, segment_layer = np.unique(np.asarray(layers)[1:], return_inverse=True)
+    per_layer = np.bincount(segment_layer, weights=time, minlength=len(ids))
+    return float(time.sum()), per_layer.tolist()
+
+
+def place_on_buildplate(pts, machine):
+    """
+    Centres a toolpath on the buildplate and levels it to touch the platform,
+    the array version of printlib.centerobject and printlib.leveltoplatform
+
+    Arguments
+        pts: N x 3 points
+        machine: machine properties (see machine_settings), delta printers are
+            centred on the origin, cartesian ones on the middle of the build volume
+    Returns
+        N x 3 array with the moved points
+    """
+    pts = as_points(pts).copy()
+    if not len(pts):
+        return pts
+    low = pts.min(axis=0)
+    high = pts.max(axis=0)
+    centre = (low + high) / 2
+    if machine.get("type") == "delta":
+        target = (0.0, 0.0)
+    else:
+        volume = machine["build_volume"]
+        target = (volume["x"] / 2, volume["y"] / 2)
+    pts[:, 0] += target[0] - centre[0]
+    pts[:, 1] += target[1] - centre[1]
+    pts[:, 2] -= low[2]
+    return pts
@@ -12,6 +12,8 @@ __version__ = "2024.08.14"
 
 import rhinoscriptsyntax as rs
 import math
+import slicinglib as sc
+import Rhino.Geometry as rg
 from ghpythonlib import treehelpers as th
 
 if brep == None:
@@ -20,33 +22,6 @@ if brep == None:
         gh.Kernel.GH_RuntimeMessageLevel.Warning, msg)
 
 
-def interpolate(input_data, output_data, x):
-    # Ensure input is within the boundaries
-    # Check if input is below the minimum boundary
-    if x < input_data[0]:
-        print(f"Warning: Input value {x} is below the minimum boundary. Returning the first output value.")
-        return output_data[0]
-    
-    # Check if input is above the maximum boundary
-    if x > input_data[-1]:
-        print(f"Warning: Input value {x} is above the maximum boundary. Returning the last output value.")
-        return output_data[-1]
-
-
-    # Find the two nearest points
-    for i in range(len(input_data) - 1):
-        if input_data[i] <= x <= input_data[i + 1]:
-            x0, y0 = input_data[i], output_data[i]
-            x1, y1 = input_data[i + 1], output_data[i + 1]
-            break
-    else:
-        raise ValueError("Input value is not within the interpolation range.")
-
-    # Perform linear interpolation
-    y = y0 + (y1 - y0) * ((x - x0) / (x1 - x0))
-    return y
-
-
 points = []
 angles = []
 target_heights = []
@@ -64,60 +39,83 @@ brep_height = maxz - minz
 contour_distance = brep_height / samples # height for contour crv
 contour_heights = [contour_distance * i for i in range(int(samples))]
 
-# first contour operation to measure overhangs
-curves = rs.AddSrfContourCrvs(brep, (bbox[0], bbox[4]), contour_distance)
-
-# Simply sampling the first point of each curve
-# for i, crv in enumerate(crvs):
-#     if i < len(crvs)-1:
-#         startpt = rs.CurveStartPoint(crvs[i])
-#         centroid = rs.CurveAreaCentroid(crv)[0]
-#         nextstartpt = rs.CurveStartPoint(crvs[i+1])
-#         vector = rs.VectorCreate(nextstartpt, startpt)
-#         zvect = rs.WorldXYPlane()[3] # world XY plane is OXYZ
-#         angle = rs.VectorAngle(zvect, vector)
-#         delta = math.sin(math.radians(angle)) # 0 to 90 deg > 0 to 1
-#         target_layer_height = max(10 - delta * 10, 3) # 0 to 90 deg > 10 to 0 layer height
-#         points.append(startpt)
-#         angles.append(angle)
-#         target_heights.append(target_layer_height)
-#         # deltas.append(delta)
-#         # offsets.append(offset)
-#         # vectors.append(vector)
-#         # offset_crvs.append(offset_crv)
-#         # widths.append(print_width + delta)
-#         # # widths.append(max(print_width, delta * 2))
-#         # deltas.append(delta)
-
-for i, crv in enumerate(curves):
-    if i < len(curves)-1:
-        pts = rs.DivideCurve(crv, crv_samples)
-        crv_angles = []
-        # pts_next = cl.divide_crv_equal(crv[i+1], div_length)
-        for j, pt in enumerate(pts):
-            closest_param = rs.CurveClosestPoint(curves[i+1], pt)
-            closest_pt = rs.EvaluateCurve(curves[i+1], closest_param)
-            vector = -rs.VectorCreate(pt, closest_pt)
-            zvect = rs.WorldXYPlane()[3] # world XY plane is OXYZ
-            angle = abs(rs.VectorAngle(zvect, vector))
-            crv_angles.append(angle)
-        angle = max(crv_angles)
-        # startpt = rs.CurveStartPoint(crvs[i])
-        # centroid = rs.CurveAreaCentroid(crv)[0]
-        # nextstartpt = rs.CurveStartPoint(crvs[i+1])
-        # vector = rs.VectorCreate(nextstartpt, startpt)
-        # zvect = rs.WorldXYPlane()[3] # world XY plane is OXYZ
-        # angle = rs.VectorAngle(zvect, vector)
+# measure the overhangs on a mesh of the brep, from its face normals (fast),
+# 0 compares consecutive contours of the brep
+mesh_overhangs = 1
+# percentile of the overhangs at each height, weighted by area, 0 uses the largest
+overhang_percentile = 0
+
+# contours at the adaptive slice heights, sliced from a mesh of the brep, 0 skips them
+mesh_contours = 1
+
+if mesh_overhangs or mesh_contours:
+    mesh = rg.Mesh()
+    for part in rg.Mesh.CreateFromBrep(rs.coercebrep(brep), rg.MeshingParameters.Default):
+        mesh.Append(part)
+    vertices, faces = sc.mesh_arrays(mesh)
+
+if mesh_overhangs:
+    # the largest overhang between consecutive contour heights
+    angles = sc.overhang_angles(vertices, faces, [minz + h for h in contour_heights],
+                                overhang_percentile or None).tolist()
+    for angle in angles:
         delta = math.sin(math.radians(angle)) # 0 to 90 deg > 0 to 1
-        target_layer_height = max(10 - delta * 10, 5) # 0 to 90 deg > 10 to 0 layer height
-        target_heights.append(target_layer_height)
-        # deltas.append(delta)
-        # offsets.append(offset)
-        # vectors.append(vector)
-        # offset_crvs.append(offset_crv)
-        # widths.append(print_width + delta)
-        # # widths.append(max(print_width, delta * 2))
-        # deltas.append(delta)
+        target_heights.append(max(10 - delta * 10, 5)) # 0 to 90 deg > 10 to 0 layer height
+else:
+    # first contour operation to measure overhangs
+    curves = rs.AddSrfContourCrvs(brep, (bbox[0], bbox[4]), contour_distance)
+
+    # Simply sampling the first point of each curve
+    # for i, crv in enumerate(crvs):
+    #     if i < len(crvs)-1:
+    #         startpt = rs.CurveStartPoint(crvs[i])
+    #         centroid = rs.CurveAreaCentroid(crv)[0]
+    #         nextstartpt = rs.CurveStartPoint(crvs[i+1])
+    #         vector = rs.VectorCreate(nextstartpt, startpt)
+    #         zvect = rs.WorldXYPlane()[3] # world XY plane is OXYZ
+    #         angle = rs.VectorAngle(zvect, vector)
+    #         delta = math.sin(math.radians(angle)) # 0 to 90 deg > 0 to 1
+    #         target_layer_height = max(10 - delta * 10, 3) # 0 to 90 deg > 10 to 0 layer height
+    #         points.append(startpt)
+    #         angles.append(angle)
+    #         target_heights.append(target_layer_height)
+    #         # deltas.append(delta)
+    #         # offsets.append(offset)
+    #         # vectors.append(vector)
+    #         # offset_crvs.append(offset_crv)
+    #         # widths.append(print_width + delta)
+    #         # # widths.append(max(print_width, delta * 2))
+    #         # deltas.append(delta)
+
+    for i, crv in enumerate(curves):
+        if i < len(curves)-1:
+            pts = rs.DivideCurve(crv, crv_samples)
+            crv_angles = []
+            # pts_next = cl.divide_crv_equal(crv[i+1], div_length)
+            for j, pt in enumerate(pts):
+                closest_param = rs.CurveClosestPoint(curves[i+1], pt)
+                closest_pt = rs.EvaluateCurve(curves[i+1], closest_param)
+                vector = -rs.VectorCreate(pt, closest_pt)
+                zvect = rs.WorldXYPlane()[3] # world XY plane is OXYZ
+                angle = abs(rs.VectorAngle(zvect, vector))
+                crv_angles.append(angle)
+            angle = max(crv_angles)
+            # startpt = rs.CurveStartPoint(crvs[i])
+            # centroid = rs.CurveAreaCentroid(crv)[0]
+            # nextstartpt = rs.CurveStartPoint(crvs[i+1])
+            # vector = rs.VectorCreate(nextstartpt, startpt)
+            # zvect = rs.WorldXYPlane()[3] # world XY plane is OXYZ
+            # angle = rs.VectorAngle(zvect, vector)
+            delta = math.sin(math.radians(angle)) # 0 to 90 deg > 0 to 1
+            target_layer_height = max(10 - delta * 10, 5) # 0 to 90 deg > 10 to 0 layer height
+            target_heights.append(target_layer_height)
+            # deltas.append(delta)
+            # offsets.append(offset)
+            # vectors.append(vector)
+            # offset_crvs.append(offset_crv)
+            # widths.append(print_width + delta)
+            # # widths.append(max(print_width, delta * 2))
+            # deltas.append(delta)
 
 print(contour_heights)
 print(target_heights)
@@ -125,44 +123,24 @@ print(target_heights)
 # for i, t in enumerate(target_heights):
 #     print(contour_heights[i], target_heights[i])
 
-# Define a safety limit for the maximum number of iterations
-max_iterations = 1000  # Set an appropriate limit based on your use case
-iteration_count = 0
-slice_heights = [0]
-slice_deltas = []
-
-# # Interpolate value at x = 1000.0
-# x = 200.0
-# result = interpolate(input_data, output_data, x)
-# print(f"Interpolated value at {x} is {result}")
-
-
-
-while slice_heights[-1] < brep_height:
-
-    current_height = slice_heights[-1]
-    
-    # Interpolate to find the appropriate layer height at the current height
-    layer_height = interpolate(contour_heights, target_heights, current_height)
-    # print(f"Layer height at {current_height} mm: {layer_height} mm")
-
-    next_height = current_height + layer_height
-    
-    if next_height > brep_height:
-        next_height = brep_height  # Ensure we don't exceed the Brep height
-    
-    slice_heights.append(next_height)
-    slice_deltas.append(layer_height)
-    
-    # Increment the iteration counter
-    iteration_count += 1
-    
-# Check if the iteration count exceeds the safety limit
-    if iteration_count >= max_iterations:
-        print("Warning: Exceeded maximum iterations.")
-        break
-
-# slice again according to the adaptive layer heights
+# layer height at any height, interpolated between the contours
+layer_height = sc.HeightFunction(contour_heights, target_heights)
+
+# step up the part with the layer height of every slice, up to the top
+slice_heights = list(sc.layer_schedule(layer_height, brep_height))
+slice_deltas = [h1 - h0 for h0, h1 in zip(slice_heights, slice_heights[1:])]
+
+# slice again according to the adaptive layer heights, one branch per layer (as b):
+# every layer is sliced at its mid-height, the first and last slice heights are the
+# bottom and top of the part where the mesh has no contour, and the contour is
+# moved to the top of the layer where it is printed. The contours are kept as
+# coordinate arrays and only turned into curves for the output
+if mesh_contours:
+    tops = [minz + h1 for h1 in slice_heights[1:]]
+    middles = [minz + (h0 + h1) / 2 for h0, h1 in zip(slice_heights, slice_heights[1:])]
+    layers = sc.slice_mesh(vertices, faces, middles)
+    c = th.list_to_tree([[rg.PolylineCurve([rg.Point3d(x, y, top) for x, y, _ in polyline.tolist()])
+                          for polyline in layer] for layer, top in zip(layers, tops)])
 
 # slicing_planes = [rs.PlaneFromFrame((0,0,h), (1,0,0), (0,1,0)) for h in slice_heights]
 # adaptive_contours = [rs.AddSrfContourCrvs(brep, slicing_planes[i]) for i in range(len(slicing_planes)-1)]
@@ -0,0 +1,186 @@
+#! python 3
+
+"""Batch exporter
+Exports a folder of toolpaths (.csv / .txt / .npy with x, y, z and the velocity
+per point) to Gcode or KRL without Rhino, one part per worker process. The
+velocity is optional for Gcode (a flow multiplier, 1 if missing) and required
+for KRL (mm/s).
+
+    python scripts/batch_export.py parts/*.csv --machine wasp --out gcode --workers 4
+
+The output only depends on the input files and the options (the file date comes
+from the modification time of the input), so a run can be repeated and compared.
+"""
+
+__author__ = "jose hernandez vargas"
+__version__ = "2024-09-02"
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "libs"))
+
+import backendlib as bl
+import exportlib as el
+import gcodelib as gcl
+import kukalib as kl
+import robotlib as rl
+import toolpathlib as tl
+
+
+def load_machine(machine):
+    """machine properties from machine_settings"""
+    with open(gcl.machine_file_path(machine)) as file:
+        return json.load(file)
+
+
+def export_gcode(path, options):
+    """exports one toolpath to Gcode, returns (output file, number of points, print time)"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    created = time.gmtime(os.path.getmtime(path))
+    pts, vel = el.load_toolpath(path)
+
+    gcode = gcl.GCodeLib(name, options.machine, created=created)
+    pts = tl.place_on_buildplate(pts, gcode.machine)
+    gcode.get_part_dims(pts)
+    gcode.add_header(options.nozzle, options.flow)
+    # a failing toolpath leaves no half-written file
+    with gcode.streaming(options.out, compression=options.compression) as file:
+        result = el.gcode_toolpath(gcode, options.machine, pts, vel, options.nozzle,
+                                   options.layerheight, options.flow,
+                                   decimate_tolerance=options.decimate,
+                                   arc_tolerance=options.arcs)
+    return file, len(result["points"]), result["time"]
+
+
+def export_krl(path, options):
+    """exports one toolpath to a KRL program, returns (output file, number of points, None)"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    created = time.gmtime(os.path.getmtime(path))
+    # robots need the velocity of every point, in mm/s
+    pts, vel = el.load_toolpath(path, velocity=None)
+    machine = load_machine(options.machine)
+
+    if options.resample:
+        pts, vel = kl.resample_time(pts, vel, options.resample, corner_angle=15)
+    if options.decimate:
+        keep = tl.decimate(pts, options.decimate, [vel])
+        pts, vel = pts[keep], vel[keep]
+
+    name = name + "_" + time.strftime("%y%m%d", created)
+    krl = kl.KukaKRL(name)
+    krl.set_tool(machine["tool"])
+    krl.set_base(machine["base"])
+    krl.krl_header(tuple(machine["start_position"]))
+    startpt = options.startpt or machine["start_point"]
+    # check the toolpath before writing anything for the robot
+    if options.check:
+        if "kinematics" not in machine:
+            raise ValueError(f"No kinematics in the machine settings '{options.machine}' to check")
+        report = rl.check_poses(el.krl_poses(pts, startpt), machine["kinematics"],
+                                start=machine["start_position"])
+        if not report["ok"]:
+            raise ValueError(rl.report_text(report).replace("\n", ", "))
+    if options.max_blocks:
+        # sub-programs are written while the toolpath is generated
+        krl.open_split(options.out, max_blocks=options.max_blocks)
+    el.krl_toolpath(krl, pts, vel, startpt, spline=options.spline)
+
+    if options.max_blocks:
+        return krl.close_split(), len(pts), None
+    file = os.path.join(options.out, name + ".src")
+    krl.write_file(file)
+    return file, len(pts), None
+
+
+def export(job):
+    """worker: exports one file, returns (input, output, points, print time, seconds)"""
+    path, options = job
+    # the workers never use Rhino, the files are the same inside and outside of it
+    bl.set_backend("numpy")
+    start = time.time()
+    if load_machine(options.machine).get("type") == "robot":
+        file, points, secs = export_krl(path, options)
+    else:
+        file, points, secs = export_gcode(path, options)
+    return path, file, points, secs, time.time() - start
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Exports toolpaths to Gcode or KRL without Rhino")
+    parser.add_argument("inputs", nargs="+",
+                        help="toolpath files (.csv, .txt, .npy) or folders")
+    parser.add_argument("--machine", default="wasp",
+                        help="machine settings file: wasp, ultimaker2 or kuka (default wasp)")
+    parser.add_argument("--out", default=".", help="output folder (default .)")
+    parser.add_argument("--nozzle", type=float, default=0.4, help="nozzle diameter (default 0.4)")
+    parser.add_argument("--layerheight", type=float, default=0.2, help="layer height (default 0.2)")
+    parser.add_argument("--flow", type=float, default=1.0, help="overflow factor (default 1)")
+    parser.add_argument("--decimate", type=float, default=0,
+                        help="tolerance to remove collinear points, 0 keeps them (default 0)")
+    parser.add_argument("--arcs", type=float, default=0,
+                        help="chord tolerance for G2 / G3 arcs, 0 writes lines (default 0)")
+    parser.add_argument("--compression", choices=["gzip", "binary"], default=None,
+                        help="compressed Gcode output")
+    parser.add_argument("--startpt", type=float, nargs=2, default=None,
+                        help="x y of the approach point for robots (default from the machine file)")
+    parser.add_argument("--max-blocks", type=int, default=0,
+                        help="robots: motion blocks per sub-program, 0 writes a single program (default 0)")
+    parser.add_argument("--spline", type=int, default=0,
+                        help="robots: points per SPLINE block, 0 writes LIN moves (default 0)")
+    parser.add_argument("--resample", type=float, default=0,
+                        help="robots: seconds per move, resamples the points at even times (default 0, off)")
+    parser.add_argument("--check", action="store_true",
+                        help="robots: check reach, axis limits and singularities, set the measured "
+                             "kinematics in the machine file first")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of processes (default: all the cores)")
+    return parser.parse_args(argv)
+
+
+def find_inputs(inputs):
+    """expands folders and patterns to a sorted list of toolpath files"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for extension in ("*.csv", "*.txt", "*.npy"):
+                paths += glob.glob(os.path.join(item, extension))
+        else:
+            paths += glob.glob(item) or [item]
+    return sorted(set(paths))
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    if load_machine(options.machine).get("type") != "robot" and options.machine not in el.PROFILES:
+        raise SystemExit(f"No export profile for machine '{options.machine}'")
+    paths = find_inputs(options.inputs)
+    os.makedirs(options.out, exist_ok=True)
+
+    start = time.time()
+    jobs = [(path, options) for path in paths]
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, options.workers)) as pool:
+        futures = [pool.submit(export, job) for job in jobs]
+        # report in the order of the inputs
+        for path, future in zip(paths, futures):
+            try:
+                path, file, points, secs, seconds = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"FAILED {path}: {e}")
+                continue
+            estimate = "" if secs is None else f", print time {secs//3600:02}:{(secs%3600)//60:02}:{secs%60:02}"
+            print(f"{path} -> {file}: {points} points{estimate} ({seconds:.2f} s)")
+
+    print(f"{len(paths) - failed} of {len(paths)} files exported in {time.time() - start:.2f} s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,6 +15,9 @@ __version__ = "2024.06.28"
 
 import rhinoscriptsyntax as rs
 import kukalib as kl
+import toolpathlib as tl
+import exportlib as el
+import robotlib as rl
 import Grasshopper as gh
 import os
 #import generalfunctions as gf
@@ -27,71 +30,65 @@ hourstamp = " at " + time.strftime("%X")  # a timestamp with the hour
 name = name + "_" + timestamp
 krl = kl.KukaKRL(name)
 
-previewpts = []
-
-
 krl.set_tool(6)
 krl.set_base(1)
 krl.krl_header(startpos)
 
-# Starting points outside of the build plate
-firstpt = (startpt[0] , startpt[1], 50.0) #HACK: hardcoded 50 mm height for first point
-
-#secondpt = (startpt[0] , startpt[1], startpt[2])
-##print firstpt
-#firstpt = (100.0 ,1600.0, 100.0)
-#secondpt = (100.0 ,1450.0, 10.0)
-
-
 # Check if both lists have the same length
 if len(PTS) != len(VEL):
     print("The lists have different lengths")
 
-# Main loop
-for i, pt in enumerate(PTS):
-    vel = round(VEL[i]/1000, 3) # velocity in m/s
-    pt = rs.coerce3dpoint(pt)
-    if i == 0:
-        krl.code.append(";FOLD LIN SPEED IS {} m/sec, INTERPOLATION SETTINGS IN FOLD".format(vel))
-        krl.code.append("$VEL.CP={}".format(vel))
-        krl.code.append("$ADVANCE=3")
-        krl.code.append(";ENDFOLD")
-        krl.code.append("$OUT[3]=FALSE")
-        plane = (firstpt[0],firstpt[1],firstpt[2], 0, 0, 0 )
-        krl.lin(plane)
-#        krl.LIN(secondpt[0],secondpt[1],secondpt[2], 0, 0, 0, 0, 0)
-        previewpts.append(firstpt)
-#        previewpts.append(secondpt)
-        lastvel = vel
-    if vel != lastvel:
-        krl.set_velocity(vel)
-#    print vel
-    krl.lin([pt.X, pt.Y, pt.Z, 0, 0, 0])
-    previewpts.append(pt)
-    lastvel = vel
-    lastpt = pt
-krl.code.append("$OUT[3]=TRUE")
-
-# Rise the nozzle quickly after the last point
-krl.set_velocity(0.25)
-krl.lin([firstpt[0], firstpt[1], lastpt[2]+50, 0, 0, 0])
-previewpts.append(rs.AddPoint(firstpt[0], firstpt[1], lastpt[2]+50))
-# Add a last exit point after the print
-krl.lin([firstpt[0], firstpt[1], lastpt[2], 0, 0, 0])
-previewpts.append(rs.AddPoint(firstpt[0], firstpt[1], lastpt[2]))
-krl.code.append("$OUT[3]=FALSE")
-
-
-
-file = os.path.dirname(os.path.realpath(ghdoc.Path))
+# seconds per move: the points are resampled so every block takes the same time
+# at its velocity, corners sharper than 15 degrees are kept. 0 keeps the points
+resample_interval = 0
+if resample_interval:
+    PTS, VEL = kl.resample_time(PTS, VEL, resample_interval, corner_angle=15)
+    PTS, VEL = PTS.tolist(), VEL.tolist()
+
+# deviation in mm allowed when removing collinear points, 0 keeps all the points
+decimate_tolerance = 0
+
+# simplify the toolpath within a tolerance, keeping the points where the velocity changes
+if decimate_tolerance:
+    keep = tl.decimate(PTS, decimate_tolerance, [VEL])
+    PTS = [PTS[i] for i in keep]
+    VEL = [VEL[i] for i in keep]
+
+# check reach, axis limits and singularities of every pose of the program (approach,
+# printing moves and exit) with the robot of machine_settings/kuka.json. 0 skips it:
+# the kinematics there are catalogue values until the base and tool of the cell are measured
+check_reach = 0
+if check_reach:
+    check = rl.check_poses(el.krl_poses(PTS, startpt), rl.load_kinematics("kuka"), start=startpos)
+    if not check["ok"]:
+        ghenv.Component.AddRuntimeMessage(
+            gh.Kernel.GH_RuntimeMessageLevel.Error, rl.report_text(check))
+
+folder = os.path.dirname(os.path.realpath(ghdoc.Path))
 extension = ".src"
-file += '\\'+ name + extension
+file = folder + '\\'+ name + extension
+
+# motion blocks per sub-program, large programs are streamed into name_001.src,
+# name_002.src... called in order by name.src. 0 writes a single program
+split_blocks = 0
+if save and split_blocks:
+    krl.open_split(folder, max_blocks=split_blocks)
+
+# points per SPLINE block, the robot looks further ahead on dense paths. 0 writes LIN moves
+spline_points = 0
+
+# approach, printing moves with their velocities and exit (see exportlib)
+previewpts = el.krl_toolpath(krl, PTS, VEL, startpt, spline=spline_points)
+previewpts = [rs.CreatePoint(*pt) for pt in previewpts]
 
 previewpath = rs.AddPolyline(previewpts)
 
 
 if save:
-    krl.write_file(file)
+    if split_blocks:
+        file = krl.close_split()
+    else:
+        krl.write_file(file)
 
     # print the filepath and a timestamp with the hour
     print('File Saved  ' + file + hourstamp)
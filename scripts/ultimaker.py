@@ -12,82 +12,43 @@ import rhinoscriptsyntax as rs # type: ignore
 import Grasshopper as gh
 import os
 import time
-import math
-from itertools import chain
-import printlib as pl
-import gcodelib as gcl
+import numpy as np
+import spatiallib as sp
+import toolpathlib as tl
+import exportlib as el
+from gcodelib import GCodeLib
 
 
 ghenv.Component.Name = "Ultimaker 2 exporter"
 
-header = []
-ini = []
-gcode = []
-
-previewpts = []
-previewflow = []
-
-# Global variables
-
-filament = 2.85
-zero = nozzle / 2
-
-timestamp = time.strftime("%Y%m%d")  # adds a timestamp with the date
 hourstamp = " at " + time.strftime("%X")  # a timestamp with the hour
 
-
-toolpath = pl.centerobject(toolpath)
-ctoolpath = pl.leveltoplatform(toolpath)
-# ctoolpath = pl.centerobject(ctoolpath)
+# initialise gcode class
+gcode = GCodeLib(filename, 'ultimaker2')
 
 # HACK: disabled mesh
 # if mesh:
 #     mesh = leveltoplatform2(mesh)
 #     mesh = centerobject2(mesh)
 
-bbox = rs.BoundingBox(ctoolpath)
+# Divide the curves in 1mm segments, one layer per curve
+points = [rs.DivideCurveLength(crv, 1) for crv in toolpath]
+layers = np.repeat(np.arange(len(points)), [len(pts) for pts in points])
+
+# Variable flow by distance to the neighbouring paths of each curve
+clearance = np.concatenate([sp.self_clearance(pts, 4) for pts in points])
+model = "clearance" if variableflow else "constant"
 
-minx = bbox[0][0]
-miny = bbox[0][1]
-minz = bbox[0][2]
-maxx = bbox[6][0]
-maxy = bbox[6][1]
-maxz = bbox[6][2]
+# centre the print on the buildplate and level it, as the batch exporter does
+PTS = tl.place_on_buildplate([pt for pts in points for pt in pts], gcode.machine)
+
+gcode.get_part_dims(rs.AddPolyline(PTS.tolist()))
+gcode.add_header(nozzle, flow)
 
 # if minz >= 1:
 #    warning = "Flying model! (not attached to the buildplate)"
 #    ghenv.Component.AddRuntimeMessage(gh.Kernel.GH_RuntimeMessageLevel.Warning, warning)
 
-# G code utilities
-
-
-def gcline(g, f, pt, *e):
-    """ Generates a line of gcode from points
-    Inputs:
-        g : G0 or G1
-        f : feedrate
-        pt: point to extract x y z coordinates
-        e : extruder movement (optional)
-    """
-    f = str(f)
-    ptx = "{:.3f}".format(pt[0])
-    pty = "{:.3f}".format(pt[1])
-    ptz = "{:.3f}".format(pt[2] + zero)
-    if e:
-        ext = "{:.3f}".format(float(e[0]))
-        # line = "G" + str(g) + " F" + f + " X" + ptx + \
-        #     " Y" + pty + " Z" + ptz + " E" + ext
-        line = "G{} F{} X{} Y{} Z{} E{}".format(
-            g, f, ptx, pty, ptz, ext)
-    else:
-        # line = "G" + str(g) + " F" + f + " X" + ptx + " Y" + pty + " Z" + ptz
-        line = "G{} F{} X{} Y{} Z{}".format(
-            g, f, ptx, pty, ptz)
-    return(line)
-
-# ###
-
-
 # if printer == "2+" or "3+":
 #     maxheight = 305
 # else:
@@ -95,151 +56,37 @@ def gcline(g, f, pt, *e):
 
 maxheight = 305
 
-
-if minx < 0 or miny < 0 or maxx > 223 or maxy > 223:
+if gcode.minx < 0 or gcode.miny < 0 or gcode.maxx > 223 or gcode.maxy > 223:
     warning = "Out of the buildplate!"
     ghenv.Component.AddRuntimeMessage(
         gh.Kernel.GH_RuntimeMessageLevel.Error, warning)
 
-if maxz > maxheight:
+if gcode.maxz > maxheight:
     warning = "MAX HEIGHT EXCEDDED"
     ghenv.Component.AddRuntimeMessage(
         gh.Kernel.GH_RuntimeMessageLevel.Error, warning)
 
-header.append(";FLAVOR:UltiGCode")
-header.append(";MATERIAL:1")
-header.append(";MATERIAL2:0")
-header.append(";TARGET_MACHINE.NAME:Ultimaker 2+")
-header.append(";NOZZLE_DIAMETER:" + str(nozzle))
-header.append(";MINX:" + str(minx))
-header.append(";MINY:" + str(miny))
-header.append(";MINZ:" + str(minz))
-header.append(";MAXX:" + str(maxx))
-header.append(";MAXY:" + str(maxy))
-header.append(";MAXZ:" + str(maxz))
-header.append(";Generated with Python / GH")
-header.append(";File created " + timestamp )
-header.append(";" + hourstamp)
-header.append(";OVERFLOW: " + str(flow))
-header.append("M82 ;absolute extrusion mode")
-header.append(";END_OF_HEADER")
-
-
-def caluclateflow(nozzle, layerheight, filament):
-    narea = (((nozzle / 2) ** 2) * math.pi)
-    filarea = (((filament / 2) ** 2) * math.pi)
-    flow = (nozzle * layerheight) / filarea * 10
-    return(flow)
-
-
-materialflow = caluclateflow(nozzle, layerheight, filament)
-
-# Feedrates
-
-F0 = 3600
-F1 = 600
-
-ext = 0.0
-tool = 0
-
-
-ini.append("G92 E0")
-ini.append("M109 S205")
-ini.append("G0 F12000 X5 Y5 Z20")
-ini.append("G280")
-ini.append("G10")
-
-# code generation
-first = 0
-
 # HACK: disabled mesh
 # Evaluate the colour in a reference mesh
 # if mesh:
 #     meshcol = rs.MeshVertexColors(mesh)
 #     meshvert = rs.MeshVertices(mesh)
 
-# TODO: start fans after a certain height (for continuous toolpath layers won't work!)
-
-
-for index, crv in enumerate(toolpath):
-    points = rs.DivideCurveLength(crv, 1)  # Divide the curve in 1mm segments
-    gcode.append(";TYPE:WALL-OUTER")
-    gcode.append(";LAYER_COUNT:" + str(len(toolpath)))
-    gcode.append(";LAYER:" + str(index))
-    for index, pt in enumerate(points):
-        if pt[2]>= 2:  # if printing height >= 2 mm start the fans
-            gcode.append("M106; Turn fans on") # turn on the fans after first layer
-        # Variable flow by distance
-        varflow = pl.selfclosestpt2(points, index, 4) / nozzle
-        # Variable flow by density map
-        # HACK: disabled mesh
-        # if mesh:
-        #     meshindex = rs.PointArrayClosestPoint(meshvert, pt)
-        #     # FIXME: uses just the red channel for now
-        #     colour = meshcol[meshindex].R / 255
-        #     # FIXME: to function: map variation from 0,2 to 1
-        #     varflow = (colour*.5) + 0.5
-        # end variable flow
-        if variableflow:
-            ext = varflow * materialflow + ext
-        else:
-            ext= materialflow + ext
-        previewpts.append(pt)
-        previewflow.append(materialflow)
-        if index == 0:
-            # first point
-            if first == 0:  # first point in the first curve only
-                # gline = gcline(0, F0, pt)
-                gline = pl.gcodeline(0,pt,f=F1)
-                gcode.append("G11") # unretract
-                first = 1
-            else:  # first point of subsequent curves
-                # gline = gcline(1, F1, pt)
-                gline = pl.gcodeline(1, pt, f=F1)
-            gcode.append(gline)
-        else:
-            # gline = gcline(1, F1, pt, ext)
-            gline = pl.gcodeline(0, pt, f=F1, e=ext)
-            gcode.append(gline)
-        # print(pt, gline)
-    # gcode.append("G10") # retract
-
-footer = []
-
-footer.append("G10")
-footer.append("M107; turn fans off")
-footer.append(";M82 ;absolute extrusion mode")
-footer.append(";End of Gcode")
-
-preview = rs.AddPolyline(previewpts)
-
-# time estimation
-est = rs.CurveLength(preview) / F1 * 60
-header.insert(1, ";TIME:{:.0f}".format(est))
-
-gcodelines = chain(header, ini, gcode, footer)
-lines = [line for line in gcodelines]
-
-
-file = os.path.dirname(os.path.realpath(ghdoc.Path))
-
-
-extension = ".gcode"
-#if "." not in ext: ext = "." + ext
-# else: pass
-
-# if os.path.exists(file) == False: # Test if file already exists; if it doesn't, proceed
-file += '\\' + timestamp + "_" + filename + \
-    extension  # Set file name and extension
-# if os.path.exists(file) == True: # If it does exists, follow the next steps
-#    file_count = len([f for f in os.walk(".").next()[2] if f[-4:] == ext]) # Find all files with the same extension
-#    file = timestamp + name + "_" + str(file_count) + ext # Add the number to the new file name as a differentiator
+# start and end gcode, feedrates and fans of the ultimaker2 profile (see exportlib),
+# a travel and ;LAYER comments at the start of every curve
+result = el.gcode_toolpath(gcode, 'ultimaker2', PTS, np.ones(len(PTS)), nozzle, layerheight, flow,
+                           model=model, clearance=clearance, layers=layers)
+
+previewpts = result["points"].tolist()
+previewflow = [1.0] * len(previewpts)
+previewlayers = layers.tolist()
+layer_times = result["layer_times"]
+
 
+folder = os.path.dirname(os.path.realpath(ghdoc.Path))
 
 if save:
-    with open(file, "w") as filePath:  # Open the file
-        for line in lines:  # Iterate through lines
-            filePath.write(line + "\n")  # Write separate lines
+    file = gcode.save(folder)
 
     # print the filepath and a timestamp with the hour
     print('File Saved  ' + file + hourstamp)
@@ -14,7 +14,11 @@ import os
 import time
 import math
 from itertools import chain
+from contextlib import nullcontext
 import printlib as pl
+import spatiallib as sp
+import toolpathlib as tl
+import exportlib as el
 from gcodelib import GCodeLib
 
 start_time = time.time()
@@ -30,6 +34,11 @@ polyline = rs.AddPolyline(PTS)
 gcode.get_part_dims(polyline)
 gcode.add_header(nozzle, flow)
 
+# stream the commands to disk as they are generated, the header is written at the end
+# compression: None (.gcode), "gzip" (.gcode.gz) or "binary" (.bgc, see bgcodelib)
+compression = None
+folder = os.path.dirname(os.path.realpath(ghdoc.Path))
+
 print("0 initialise class / add header: {:.4f} seconds".format(time.time() - start_time))
 
 previewpts = []
@@ -63,125 +72,38 @@ toolpath = pl.leveltoplatform(toolpath)
 # turn back into point list
 PTS = rs.CurvePoints(toolpath)
 
-print("2 PTS to polyline and back: {:.4f} seconds".format(time.time() - start_time))
-
-
-materialflow = pl.caluclate_flow(nozzle, layerheight, filament) / 10 * flow
-# print(nozzle, layerheight, filament, materialflow)
-
-print("3 material flow calc: {:.4f} seconds".format(time.time() - start_time))
-
-
-
-tool = 0
-
-# initial commands
-gcode.commands.append("G21 ;metric values")
-gcode.commands.append("G90 ;absolute positioning")
-gcode.commands.append("M82 ;set extruder to absolute mode")
-gcode.commands.append("M107 ;start with the fan off")
-gcode.commands.append("G28 X0 Y0 ;move X/Y to min endstops")
-gcode.commands.append("G28 Z0 ;move Z to min endstops")
-gcode.commands.append("T0")
-gcode.commands.append("G92 E0 ;zero the extruded length")
-gcode.commands.append("M140 S40; print bed") # sets up the bed temperature without waiting
-gcode.commands.append("M109 S200; print head") # sets up the printhead temperatire and waits
-gcode.commands.append("G0 F9000 X0 Y0 Z20")
-# gcode.commands.append("G1 F200 E-{retraction_dual_amount}")
-
-
-
-# Feedrates
-
-F0 = 3600
-F1 = 600 # start speed F1200 after 2 mm
-
-# code generation
-first = True
-ext = 0
-adhesion_layer = 1
-fans_off = True
-
-print("4 intial commands: {:.4f} seconds".format(time.time() - start_time))
-
-
-for i, pt in enumerate(PTS):
-    # start slower, with extra extrusion and and without fans
-    if pt[2]>= 2 and fans_off:  # if printing height >= 2 mm start the fans
-        gcode.commands.append("M106; Turn fans on") # turn on the fans after first layer
-        adhesion_layer = 0
-        fans_off = False
-        F1 = 900
-    # Variable flow by distance
-    varflow = pl.selfclosestpt2(PTS, i, 4) / nozzle
-    # end variable flow
-    if i < len(PTS) - 1:  # Ensure there is a next point
-        next_pt = PTS[i + 1]
-        dist = rs.Distance(pt, next_pt)
-    ext = materialflow * VEL[i] * dist + ext + (materialflow * dist * adhesion_layer)
-    previewpts.append(pt)
-    previewflow.append(VEL[i] * dist)
-    if i == 0:
-        # first point
-        if first:  # first point in the first curve only
-            # gline = gcline(0, F0, pt)
-            gline = pl.gcodeline(0,pt,f=F1)
-            gcode.commands.append("G11") # unretract
-            first = False
-        else:  # first point of subsequent curves
-            # gline = gcline(1, F1, pt)
-            gline = pl.gcodeline(1, pt, f=F1)
-        gcode.commands.append(gline)
-    else:
-        # gline = gcline(1, F1, pt, ext)
-        gline = pl.gcodeline(0, pt, f=F1, e=ext)
-        gcode.commands.append(gline)
-    # print(pt, gline)
-    # gcode.commands.append("G10") # retract
-
-print("5 main loop: {:.4f} seconds".format(time.time() - start_time))
-
-
-gcode.commands.append("G10")
-gcode.commands.append(";M82 ;absolute extrusion mode")
-gcode.commands.append("")
-gcode.commands.append(";End of Gcode")
-
-gcode.commands.append("M104 S0  ;extruder heater off")
-gcode.commands.append("M140 S0  ;heated bed heater off")
-gcode.commands.append("G91  ;relative positioning")
-gcode.commands.append("G1 E-1 F300   ;retract the filament a bit")
-gcode.commands.append("G1 Z+1 E-5 F9000 ;move Z up a bit and retract filament even more")
-gcode.commands.append("M107  ;fan off")
-gcode.commands.append("G28 ;move X/Y to min endstops, so the head is out of the way")
-gcode.commands.append(";M84 ;steppers off")
-gcode.commands.append("G90 ;absolute positioning")
+# deviation in mm allowed when removing collinear points, 0 keeps all the points
+decimate_tolerance = 0
 
-preview = rs.AddPolyline(previewpts)
+print("2 PTS to polyline and back: {:.4f} seconds".format(time.time() - start_time))
 
-# time estimation
-secs = int(rs.CurveLength(preview) / F1 * 60)
-gcode.header.insert(1, f"; TIME: {secs//3600:02}:{(secs%3600)//60:02}:{secs%60:02}")
 
+# chord tolerance in mm to replace G1 moves with G2 / G3 arcs, 0 writes only G1 moves
+arc_tolerance = 0
 
-file = os.path.dirname(os.path.realpath(ghdoc.Path))
-extension = ".gcode"
+# start and end gcode, feedrates, fans and adhesion flow of the wasp profile (see exportlib)
+# if the export fails the half-written file is removed
+with gcode.streaming(folder, compression=compression) if save else nullcontext() as file:
+    result = el.gcode_toolpath(gcode, 'wasp', PTS, VEL, nozzle, layerheight, flow,
+                               decimate_tolerance=decimate_tolerance, arc_tolerance=arc_tolerance)
+PTS = result["points"].tolist()
+VEL = result["velocities"].tolist()
+layer_times = result["layer_times"]
 
-file += '\\' + timestamp + "_" + filename + \
-    extension  # Set file name and extension
+dists = tl.segment_lengths(PTS)
+previewpts = list(PTS)
+previewflow = [VEL[i] * dists[min(i, len(dists) - 1)] for i in range(len(PTS))]
 
+# Variable flow by distance to the closest non-consecutive point, for all the points
+# at once (the gcode follows VEL, the ultimaker exporter can print with it)
+clearance = sp.self_clearance(PTS, 4)
+varflow = (clearance / nozzle).tolist()
 
+print("5 main loop: {:.4f} seconds".format(time.time() - start_time))
 print("6 end and compile gcode: {:.4f} seconds".format(time.time() - start_time))
 
 
 if save:
-    # gcode.save() FIXME: this function is not working
-    with open(file, "w") as filePath:  # Open the file
-        for line in gcode.header:  # Iterate through lines
-            filePath.write(line + "\n")  # Write separate lines
-        for line in gcode.commands:  # Iterate through lines
-            filePath.write(line + "\n")  # Write separate lines
-
     # print the filepath and a timestamp with the hour
     print('File Saved ' + file + hourstamp)
 else: